@@ -0,0 +1,303 @@
+import random
+import struct
+
+QTYPE_A = 1
+QTYPE_NS = 2
+QTYPE_CNAME = 5
+QTYPE_SOA = 6
+QTYPE_OPT = 41
+
+RCODE_NOERROR = 0
+RCODE_FORMERR = 1
+RCODE_SERVFAIL = 2
+RCODE_NXDOMAIN = 3
+RCODE_NOTIMP = 4
+
+OPCODE_QUERY = 0
+
+_NAME_TYPES = (QTYPE_NS, QTYPE_CNAME, 12)  # NS, CNAME, PTR
+
+
+def read_name(buf, pos):
+    """
+    Decode a (possibly compressed) domain name starting at pos.
+    Returns (name, position just past the name in the original stream).
+    """
+    labels = []
+    end = None
+    hops = 0
+    while True:
+        length = buf[pos]
+        if length >= 0xC0:
+            if end is None:
+                end = pos + 2
+            pos = ((length & 0x3F) << 8) | buf[pos + 1]
+            hops += 1
+            if hops > 64:
+                raise ValueError("compression pointer loop")
+            continue
+        if length == 0:
+            pos += 1
+            break
+        labels.append(bytes(buf[pos + 1:pos + 1 + length]).decode("ascii", "replace"))
+        pos += 1 + length
+    name = ".".join(labels) + "." if labels else "."
+    return name, end if end is not None else pos
+
+
+class WireRR:
+    """One resource record; rdata is only decoded when it is read."""
+
+    __slots__ = ("rname", "rtype", "ttl", "_buf", "_rdoff", "_rdlen")
+
+    def __init__(self, rname, rtype, ttl, buf, rdoff, rdlen):
+        self.rname = rname
+        self.rtype = rtype
+        self.ttl = ttl
+        self._buf = buf
+        self._rdoff = rdoff
+        self._rdlen = rdlen
+
+    @property
+    def rdata(self):
+        buf, off = self._buf, self._rdoff
+        if self.rtype == QTYPE_A and self._rdlen == 4:
+            return "%d.%d.%d.%d" % (buf[off], buf[off + 1], buf[off + 2], buf[off + 3])
+        if self.rtype in _NAME_TYPES:
+            return read_name(buf, off)[0]
+        if self.rtype == QTYPE_SOA:
+            mname, pos = read_name(buf, off)
+            rname, pos = read_name(buf, pos)
+            numbers = struct.unpack_from("!5I", buf, pos)
+            return " ".join([mname, rname] + [str(n) for n in numbers])
+        return bytes(buf[off:off + self._rdlen]).hex()
+
+
+class WireMessage:
+    """
+    The parts of a DNS response the resolve loop uses: header fields, the
+    first question and the three RR sections as WireRR lists. Attribute
+    names follow dnslib's DNSRecord (rr / auth / ar) so callers can use
+    either.
+    """
+
+    __slots__ = ("id", "flags", "qname", "qtype", "rr", "auth", "ar")
+
+    @property
+    def rcode(self):
+        return self.flags & 0x000F
+
+    @property
+    def tc(self):
+        return bool(self.flags & 0x0200)
+
+    @property
+    def aa(self):
+        return bool(self.flags & 0x0400)
+
+
+def _walk(buf):
+    """Yield (section, rr, ttl_offset) for every RR after the question section."""
+    qdcount, ancount, nscount, arcount = struct.unpack_from("!4H", buf, 4)
+    pos = 12
+    for _ in range(qdcount):
+        _, pos = read_name(buf, pos)
+        pos += 4
+    for section, count in ((0, ancount), (1, nscount), (2, arcount)):
+        for _ in range(count):
+            rname, pos = read_name(buf, pos)
+            rtype, _, ttl, rdlen = struct.unpack_from("!HHIH", buf, pos)
+            ttl_offset = pos + 4
+            pos += 10
+            yield section, WireRR(rname, rtype, ttl, buf, pos, rdlen), ttl_offset
+            pos += rdlen
+
+
+def parse_question(data):
+    """Return (id, qname, qtype) of a query without building a DNSRecord."""
+    buf = memoryview(data)
+    qid = struct.unpack_from("!H", buf)[0]
+    qname, pos = read_name(buf, 12)
+    qtype = struct.unpack_from("!H", buf, pos)[0]
+    return qid, qname, qtype
+
+
+def is_query(data):
+    """True for a message with a full header and the QR bit clear."""
+    return len(data) >= 12 and not data[2] & 0x80
+
+
+def opcode(data):
+    return (data[2] >> 3) & 0x0F
+
+
+def question_name(data):
+    """Lower-cased qname of the first question, or None if it cannot be read."""
+    try:
+        return read_name(memoryview(data), 12)[0].lower()
+    except (IndexError, ValueError):
+        return None
+
+
+def parse_response(data):
+    buf = memoryview(data)
+    msg = WireMessage()
+    msg.id, msg.flags = struct.unpack_from("!HH", buf)
+    msg.qname, pos = read_name(buf, 12)
+    msg.qtype = struct.unpack_from("!H", buf, pos)[0]
+    sections = ([], [], [])
+    for section, rr, _ in _walk(buf):
+        sections[section].append(rr)
+    msg.rr, msg.auth, msg.ar = sections
+    return msg
+
+
+def is_negative(msg):
+    """
+    True for an RFC 2308 negative response: NXDOMAIN, or NOERROR with no
+    answer and no referral (NODATA). An empty NOERROR only counts as NODATA
+    when it is authoritative or carries an SOA; otherwise it is a lame
+    server's non-answer.
+    """
+    if msg.rr:
+        return False
+    if msg.rcode == RCODE_NXDOMAIN:
+        return True
+    if msg.rcode != RCODE_NOERROR or any(rr.rtype == QTYPE_NS for rr in msg.auth):
+        return False
+    return msg.aa or any(rr.rtype == QTYPE_SOA for rr in msg.auth)
+
+
+def answer_count(data):
+    return struct.unpack_from("!H", data, 6)[0]
+
+
+def adjust_ttls(data, elapsed, query_id=None, floor=0):
+    """
+    Copy of a cached response with every TTL reduced by `elapsed` seconds
+    (but not below `floor`) and, optionally, a new header ID. Rewrites the
+    TTL fields in place instead of re-encoding the message.
+    """
+    out = bytearray(data)
+    if elapsed > 0:
+        for _, rr, ttl_offset in _walk(memoryview(data)):
+            if rr.rtype != QTYPE_OPT:  # its "TTL" holds EDNS flags
+                struct.pack_into("!I", out, ttl_offset, max(rr.ttl - elapsed, floor))
+    if query_id is not None:
+        struct.pack_into("!H", out, 0, query_id)
+    return bytes(out)
+
+
+def encode_name(name):
+    """Uncompressed wire form of a domain name."""
+    return b"".join(bytes([len(label)]) + label.encode("ascii")
+                    for label in name.rstrip(".").split(".") if label) + b"\x00"
+
+
+def build_query(name, qtype=QTYPE_A, rd=True):
+    """Wire-format query for (name, qtype) with a random ID."""
+    header = struct.pack("!HHHHHH", random.randrange(65536), 0x0100 if rd else 0, 1, 0, 0, 0)
+    return header + encode_name(name) + struct.pack("!HH", qtype, 1)
+
+
+def with_rd(query_data):
+    """query_data with the recursion-desired flag set, for a recursive upstream."""
+    return query_data[:2] + bytes([query_data[2] | 0x01]) + query_data[3:]
+
+
+def error_response(query_data, rcode):
+    """Reply to query_data with no records and the given rcode (e.g. SERVFAIL)."""
+    buf = memoryview(query_data)
+    qid, flags = struct.unpack_from("!HH", buf)
+    _, pos = read_name(buf, 12)
+    flags = 0x8080 | (flags & 0x7900) | rcode  # QR, RA; opcode and RD copied
+    return struct.pack("!HHHHHH", qid, flags, 1, 0, 0, 0) + bytes(buf[12:pos + 4])
+
+
+def synthesize_nxdomain(query_data, negative, elapsed=0):
+    """
+    NXDOMAIN reply to query_data built from the cached NXDOMAIN response
+    for an ancestor name (RFC 8020): the query's header and question plus
+    the SOA records of `negative`, re-encoded without compression and with
+    their TTLs reduced by `elapsed` seconds.
+    """
+    qbuf = memoryview(query_data)
+    qid, flags = struct.unpack_from("!HH", qbuf)
+    _, pos = read_name(qbuf, 12)
+    buf = memoryview(negative)
+    authority = []
+    for section, rr, _ in _walk(buf):
+        if section == 1 and rr.rtype == QTYPE_SOA:
+            mname, off = read_name(buf, rr._rdoff)
+            rname, off = read_name(buf, off)
+            rdata = encode_name(mname) + encode_name(rname) + bytes(buf[off:off + 20])
+            authority.append(encode_name(rr.rname)
+                             + struct.pack("!HHIH", QTYPE_SOA, 1, max(rr.ttl - elapsed, 0), len(rdata))
+                             + rdata)
+    flags = 0x8080 | (flags & 0x7900) | RCODE_NXDOMAIN  # QR, RA; opcode and RD copied
+    header = struct.pack("!HHHHHH", qid, flags, 1, 0, len(authority), 0)
+    return header + bytes(qbuf[12:pos + 4]) + b"".join(authority)
+
+
+def with_edns(query_data, payload):
+    """
+    query_data cut down to header and question, plus one OPT record
+    (RFC 6891) advertising `payload` bytes of UDP buffer.
+    """
+    buf = memoryview(query_data)
+    _, pos = read_name(buf, 12)
+    header = bytearray(buf[:12])
+    struct.pack_into("!HHH", header, 6, 0, 0, 1)
+    return bytes(header) + bytes(buf[12:pos + 4]) + struct.pack("!BHHIH", 0, QTYPE_OPT, payload, 0, 0)
+
+
+def edns_payload(data):
+    """UDP payload size from the message's OPT record, or None without one."""
+    buf = memoryview(data)
+    for section, rr, ttl_offset in _walk(buf):
+        if section == 2 and rr.rtype == QTYPE_OPT:
+            return struct.unpack_from("!H", buf, ttl_offset - 2)[0]
+    return None
+
+
+def strip_opt(data):
+    """data without its OPT record, if that is the last record of the message."""
+    buf = memoryview(data)
+    for section, rr, ttl_offset in _walk(buf):
+        start = ttl_offset - 5  # OPT owner is the root: one zero byte
+        if (section == 2 and rr.rtype == QTYPE_OPT and buf[start] == 0
+                and rr._rdoff + rr._rdlen == len(data)):
+            out = bytearray(buf[:start])
+            struct.pack_into("!H", out, 10, struct.unpack_from("!H", buf, 10)[0] - 1)
+            return bytes(out)
+    return data
+
+
+def truncated(data):
+    return bool(data[2] & 0x02)
+
+
+def fit_udp(response, query_data, payload=1232):
+    """
+    response as it may go back over UDP to the client that sent query_data:
+    with an OPT record (advertising `payload`) exactly when the client used
+    EDNS, and cut down to header and question with TC set if it is larger
+    than the client's buffer, so the client retries over TCP.
+    """
+    limit = edns_payload(query_data)
+    has_opt = edns_payload(response) is not None
+    if limit is None and has_opt:
+        response = strip_opt(response)
+    elif limit is not None and not has_opt:
+        out = bytearray(response)
+        struct.pack_into("!H", out, 10, struct.unpack_from("!H", out, 10)[0] + 1)
+        response = bytes(out) + struct.pack("!BHHIH", 0, QTYPE_OPT, payload, 0, 0)
+    limit = max(limit or 512, 512)
+    if len(response) <= limit:
+        return response
+    buf = memoryview(response)
+    _, pos = read_name(buf, 12)
+    header = bytearray(buf[:12])
+    header[2] |= 0x02
+    struct.pack_into("!HHH", header, 6, 0, 0, 0)
+    return bytes(header) + bytes(buf[12:pos + 4])
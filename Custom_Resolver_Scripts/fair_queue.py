@@ -0,0 +1,136 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+# Per-client token bucket: sustained queries/s (0 = no limit) and burst
+# size. Set by resolver_server.serve().
+RATE = 0.0
+BURST = 20
+# Over-rate queries wait for a token up to this long; later ones are dropped
+MAX_DELAY = 1.0
+# Queries one client may have waiting before further ones are dropped
+CLIENT_QUEUE = 100
+# Client IP -> share of the resolver relative to the default weight 1
+WEIGHTS = {}
+# Clients whose state is kept; beyond that the least recently seen is forgotten
+MAX_CLIENTS = 10000
+
+
+class ClientState:
+    """Token bucket, queue occupancy and counters of one source IP."""
+
+    __slots__ = ("tokens", "stamp", "queued", "last_tag", "queries", "delayed", "dropped")
+
+    def __init__(self, now):
+        self.tokens = float(BURST)
+        self.stamp = now
+        self.queued = 0
+        self.last_tag = 0.0
+        self.queries = 0
+        self.delayed = 0
+        self.dropped = 0
+
+    def take(self, now):
+        """Spend a token; returns how long the query must wait for it (0 = none)."""
+        if not RATE:
+            return 0.0
+        self.tokens = min(BURST, self.tokens + (now - self.stamp) * RATE)
+        self.stamp = now
+        self.tokens -= 1
+        return -self.tokens / RATE if self.tokens < 0 else 0.0
+
+
+class FairQueue:
+    """
+    Admission and scheduling in front of the resolve workers. Each source
+    IP has a token bucket. A query over the rate is held until its token
+    is due, or dropped if that is more than MAX_DELAY away or the client
+    already has CLIENT_QUEUE queries waiting. Admitted queries are served
+    in weighted fair order (start-time fair queuing): each gets a virtual
+    tag of max(now, client's previous tag) + 1/weight and the lowest tag
+    goes next. A client flooding the resolver therefore only lengthens its
+    own queue, and everybody else still gets their share of the workers.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.ready = []    # (tag, seq, client, item)
+        self.waiting = []  # (due, seq, client, item): held for a token
+        self.seq = itertools.count()
+        self.vtime = 0.0
+        self.clients = OrderedDict()  # least recently seen first
+
+    def depth(self):
+        """Queries admitted and not yet handed to a worker."""
+        return len(self.ready) + len(self.waiting)
+
+    def _client(self, client, now):
+        state = self.clients.get(client)
+        if state is not None:
+            self.clients.move_to_end(client)
+            return state
+        if len(self.clients) >= MAX_CLIENTS:
+            # forget the least recently seen client, unless it still has
+            # queries waiting: then it goes back to the end for now
+            oldest, old = self.clients.popitem(last=False)
+            if old.queued:
+                self.clients[oldest] = old
+        state = self.clients[client] = ClientState(now)
+        return state
+
+    def put(self, client, item):
+        """Queue item from client; False if it was dropped."""
+        now = time.monotonic()
+        with self.cond:
+            state = self._client(client, now)
+            state.queries += 1
+            delay = state.take(now)
+            if delay > MAX_DELAY or state.queued >= CLIENT_QUEUE:
+                if RATE:
+                    state.tokens += 1  # a dropped query does not use up the rate
+                state.dropped += 1
+                return False
+            state.queued += 1
+            if delay:
+                state.delayed += 1
+                heapq.heappush(self.waiting, (now + delay, next(self.seq), client, item))
+            else:
+                self._ready(client, state, item)
+            self.cond.notify()
+            return True
+
+    def _ready(self, client, state, item):
+        tag = max(self.vtime, state.last_tag) + 1.0 / WEIGHTS.get(client, 1.0)
+        state.last_tag = tag
+        heapq.heappush(self.ready, (tag, next(self.seq), client, item))
+
+    def get(self):
+        """Block until a query may be served and return its item."""
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                while self.waiting and self.waiting[0][0] <= now:
+                    _, _, client, item = heapq.heappop(self.waiting)
+                    self._ready(client, self.clients[client], item)
+                if self.ready:
+                    tag, _, client, item = heapq.heappop(self.ready)
+                    self.vtime = tag
+                    self.clients[client].queued -= 1
+                    return item
+                self.cond.wait(self.waiting[0][0] - now if self.waiting else None)
+
+    def counters(self):
+        """(client, queries, delayed, dropped) for every client seen, busiest first."""
+        with self.cond:
+            rows = [(c, s.queries, s.delayed, s.dropped) for c, s in self.clients.items()]
+        return sorted(rows, key=lambda row: -row[1])
+
+    def format_table(self, limit=20):
+        rows = self.counters()
+        lines = [f"Clients ({len(rows)}, rate {RATE:g} q/s, burst {BURST}):",
+                 f"  {'Client':<18}{'Queries':>9}{'Delayed':>9}{'Dropped':>9}"]
+        for client, queries, delayed, dropped in rows[:limit]:
+            lines.append(f"  {client:<18}{queries:>9}{delayed:>9}{dropped:>9}")
+        return "\n".join(lines)
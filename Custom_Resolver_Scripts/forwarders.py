@@ -0,0 +1,78 @@
+import itertools
+import threading
+import time
+import dns_wire
+import upstream
+from resolver_cache import zone_chain
+
+# zone -> upstream recursive resolvers its names are forwarded to; the
+# zone "." forwards everything. Set by resolver_server.serve().
+ZONES = {}
+# Seconds between health probes of every forwarder (0 = no probing)
+HEALTH_INTERVAL = 10.0
+
+_turn = itertools.count()
+_health_thread = None
+
+
+def parse_zone(spec):
+    """(zone, servers) from a --forward-zone "ZONE=IP[,IP...]" option."""
+    zone, _, ips = spec.partition("=")
+    servers = [ip.strip() for ip in ips.split(",") if ip.strip()]
+    if not zone.strip() or not servers:
+        raise ValueError(f"expected ZONE=IP[,IP...], got {spec!r}")
+    return zone.strip().lower().rstrip(".") + ".", servers
+
+
+def configure(forwarders=None, zones=()):
+    """Build ZONES from --forwarders (the global pool) and parsed --forward-zone options."""
+    ZONES.clear()
+    if forwarders:
+        ZONES["."] = list(forwarders)
+    for zone, servers in zones:
+        ZONES[zone] = servers
+
+
+def route(qname):
+    """
+    (zone, servers) when qname falls in a forwarded zone, else (None, None).
+    servers are the pool's healthy forwarders, starting at the next one in
+    round-robin order so load spreads over the pool; empty when every
+    forwarder is in the upstream penalty box.
+    """
+    if not ZONES:
+        return None, None
+    for zone in zone_chain(qname.lower()) + ["."]:
+        pool = ZONES.get(zone)
+        if pool is not None:
+            healthy = upstream.healthy(pool)
+            if healthy:
+                start = next(_turn) % len(healthy)
+                healthy = healthy[start:] + healthy[:start]
+            return zone, healthy
+    return None, None
+
+
+def usable(resp):
+    """Whether a forwarder's reply settles the query (SERVFAIL, REFUSED etc. do not)."""
+    return resp.rcode in (dns_wire.RCODE_NOERROR, dns_wire.RCODE_NXDOMAIN)
+
+
+def _probe_loop():
+    probe = dns_wire.build_query(".", dns_wire.QTYPE_NS)
+    while True:
+        time.sleep(HEALTH_INTERVAL)
+        servers = {s for pool in ZONES.values() for s in pool}
+        for server in servers:
+            # exchange() feeds the RTT table: a timeout extends the penalty,
+            # an answer releases the forwarder from the penalty box
+            threading.Thread(target=upstream.exchange, args=(probe, server, upstream.TIMEOUT),
+                             daemon=True).start()
+
+
+def start_health_checks():
+    """Probe every forwarder in the background every HEALTH_INTERVAL seconds."""
+    global _health_thread
+    if ZONES and HEALTH_INTERVAL > 0 and _health_thread is None:
+        _health_thread = threading.Thread(target=_probe_loop, daemon=True)
+        _health_thread.start()
@@ -0,0 +1,372 @@
+"""
+The iterative resolution walk shared by the resolver scripts: cache,
+forwarding and the root-to-authoritative walk with QNAME minimisation.
+The scripts differ only in how one step queries a zone's servers, which
+they pass to main() as ask(query, servers) -> (data or None, server that
+answered, rtt in ms, servers that timed out).
+"""
+import time
+from dnslib import DNSRecord
+import dns_wire
+from resolver_cache import ResolverCache, referral
+from singleflight import SingleFlight
+from prefetch import Prefetcher
+from metrics import METRICS
+import forwarders
+import ns_lookup
+import qname_min
+import resolver_server
+import upstream
+import warmup
+
+ROOT_SERVERS = [
+    "198.41.0.4",
+    "199.9.14.201",
+    "192.33.4.12",
+]
+
+# Set by main() to the calling script's server-selection strategy
+ASK = None
+
+CACHE = ResolverCache()
+FLIGHTS = SingleFlight()
+PREFETCH = Prefetcher(
+    lambda qname, qtype: iterative_resolve(dns_wire.build_query(qname, qtype), refresh=True))
+
+
+def iterative_resolve(query_data, budget=None, refresh=False):
+    """
+    Resolve one query, joining an identical (qname, qtype) resolution if
+    one is already in flight instead of walking the hierarchy again.
+    budget limits recursion for nested NS-name lookups; refresh skips the
+    cached answer so a prefetch goes upstream.
+    """
+    start_time = time.time()
+    qid, qname, qtype = dns_wire.parse_question(query_data)
+    key = (qname.lower(), qtype)
+    client_query = budget is None and not refresh
+    if client_query:
+        PREFETCH.seen(key)
+    budget = budget or ns_lookup.Budget()
+    if key in budget.path:
+        # an NS lookup looping back to a name this chain is already
+        # resolving; joining that flight would wait on ourselves
+        return resolve_uncoalesced(query_data, qid, qname, qtype, budget)
+    budget.path += (key,)
+    # a refresh runs under its own key: clients arriving meanwhile should
+    # read the still-cached answer, not wait for the refresh
+    flight = key + ("refresh",) if refresh else key
+    result, shared = FLIGHTS.do(
+        flight, lambda: resolve_uncoalesced(query_data, qid, qname, qtype, budget, refresh))
+    if client_query:
+        METRICS.upstream_queries(budget.used())
+    if not shared:
+        return result
+
+    response, _, _, qname = result
+    if response:
+        response = query_data[:2] + response[2:]
+    log = [{
+        "step": 1,
+        "mode": "Iterative",
+        "stage": "Coalesced",
+        "server": "in-flight",
+        "rtt": None,
+        "response": [f"Joined in-flight resolution of {qname} "
+                     f"({FLIGHTS.coalesced} coalesced so far)"]
+    }]
+    total_time = (time.time() - start_time) * 1000
+    return response, log, round(total_time, 2), qname
+
+
+def resolve_uncoalesced(query_data, qid, qname, qtype, budget, refresh=False):
+    log = []
+    start_time = time.time()
+    current_servers = ROOT_SERVERS
+    current_zone = "."
+    response = None
+    step = 1
+    # failures caused by our own query budget say nothing about the name
+    memo_failure = True
+
+    hit = None if refresh else CACHE.lookup_answer(qname, qtype, qid)
+    cached = hit[0] if hit else None
+    if cached or (not refresh and CACHE.get_failure(qname, qtype)):
+        if not cached:
+            summary = f"Hit: recent failure for {qname}, answering SERVFAIL"
+        else:
+            kind = "answer" if dns_wire.answer_count(cached) else "negative answer"
+            summary = f"Hit: {kind} for {qname}"
+            action = PREFETCH.consider(qname, qtype, hit[1], hit[2])
+            if action == "stale":
+                summary = f"Hit: stale {kind} for {qname}, refreshing in background"
+            elif action == "prefetch":
+                summary += f" ({hit[1]:.0f}s left, prefetching)"
+        log.append({
+            "step": step,
+            "mode": "Iterative",
+            "stage": "Cache",
+            "server": "cache",
+            "rtt": None,
+            "response": [summary]
+        })
+        total_time = (time.time() - start_time) * 1000
+        return cached, log, round(total_time, 2), qname
+
+    nx = None if refresh else CACHE.nxdomain_ancestor(qname, query_data)
+    if nx:
+        log.append({
+            "step": step,
+            "mode": "Iterative",
+            "stage": "Cache",
+            "server": "cache",
+            "rtt": None,
+            "response": [f"Hit: {nx[0]} does not exist, so neither does {qname} (NXDOMAIN)"]
+        })
+        total_time = (time.time() - start_time) * 1000
+        return nx[1], log, round(total_time, 2), qname
+
+    forward_zone, forward_pool = forwarders.route(qname)
+    if forward_zone is not None:
+        log.append({
+            "step": step,
+            "mode": "Recursive",
+            "stage": "Cache",
+            "server": "cache",
+            "rtt": None,
+            "response": [f"Miss: forwarding via the {forward_zone} pool "
+                         f"({len(forward_pool)} healthy forwarders)"]
+        })
+        response, step = forward(query_data, qname, qtype, forward_zone, forward_pool, budget, log, step)
+        if response:
+            total_time = (time.time() - start_time) * 1000
+            return response, log, round(total_time, 2), qname
+        step += 1
+
+    zone, ips = CACHE.closest_delegation(qname)
+    if zone:
+        current_servers = ips
+        current_zone = zone
+        summary = f"starting at cached delegation {zone} ({len(ips)} servers)"
+    else:
+        summary = "starting at root"
+    if forward_zone is None:
+        summary = "Miss: " + summary
+    else:
+        summary = "No forwarder answered, falling back to iterative: " + summary
+    log.append({
+        "step": step,
+        "mode": "Iterative",
+        "stage": "Cache",
+        "server": "cache",
+        "rtt": None,
+        "response": [summary]
+    })
+
+    minimise = qname_min.MAX_MINIMISE if qname_min.ENABLED else 0
+    while True:
+        step += 1
+        if not budget.spend():
+            log.append({
+                "step": step,
+                "mode": "Iterative",
+                "stage": "Budget",
+                "server": "-",
+                "rtt": None,
+                "response": ["Upstream query budget exhausted"]
+            })
+            memo_failure = False
+            break
+
+        # with QNAME minimisation, ask only about the next label down
+        ask = qname_min.next_name(CACHE, qname, current_zone) if minimise else None
+        if ask is None:
+            sent = query_data
+        else:
+            minimise -= 1
+            sent = dns_wire.build_query(ask, qname_min.QTYPE, rd=False)
+
+        data, server, rtt, timed_out = ASK(sent, upstream.order_servers(current_servers))
+        for silent in timed_out:
+            log.append({
+                "step": step,
+                "mode": "Iterative",
+                "stage": "Timeout",
+                "server": silent,
+                "rtt": None,
+                "response": ["No response (timeout)"]
+            })
+        if data is None:
+            break
+
+        resp = dns_wire.parse_response(data)
+
+        if ask is None:
+            CACHE.store_response(qname, qtype, resp, data, current_zone)
+        else:
+            CACHE.store_response(ask, qname_min.QTYPE, resp, data, current_zone)
+
+        if current_zone == ".":
+            stage = "Root"
+        elif len(resp.auth) > 0 and not resp.rr:
+            stage = "TLD"
+        else:
+            stage = "Authoritative"
+
+        response_summary = summarize(resp, data)
+        if ask is not None:
+            response_summary = [f"Minimised query: {ask}"] + response_summary
+
+        log.append({
+            "step": step,
+            "mode": "Iterative",
+            "stage": stage,
+            "server": server,
+            "rtt": round(rtt, 2),
+            "response": response_summary
+        })
+        METRICS.stage(stage, rtt)
+
+        if ask is not None:
+            if resp.rcode == dns_wire.RCODE_NXDOMAIN:
+                # nothing exists below a name that does not exist (RFC 8020)
+                response = dns_wire.synthesize_nxdomain(query_data, data)
+                break
+            if resp.rcode != dns_wire.RCODE_NOERROR:
+                minimise = 0  # server mishandles minimised queries: ask the full name
+                continue
+            if resp.rr or dns_wire.is_negative(resp):
+                qname_min.learn(CACHE, ask, resp)
+                continue  # not a zone cut: same servers, one label further
+        elif resp.rr or dns_wire.is_negative(resp):
+            if qname_min.ENABLED and resp.rcode == dns_wire.RCODE_NOERROR:
+                qname_min.learn(CACHE, qname.lower(), resp)  # names below it start here too
+            response = data  # an answer, NXDOMAIN or NODATA
+            break
+
+        # follow only a downward referral towards qname, with in-bailiwick glue
+        cuts, glue = referral(ask or qname, resp, current_zone)
+        if not cuts:
+            break
+        cut = max(cuts, key=lambda zone: zone.count("."))
+        ns_names = cuts[cut][0]
+        ns_ips = [ip for ns in ns_names for ip in glue.get(ns.lower(), ([], 0))[0]]
+
+        if not ns_ips:
+            for ns in dict.fromkeys(ns_names):
+                ns_ips.extend(CACHE.get_glue(ns) or [])
+
+            if not ns_ips and not budget.can_nest():
+                log.append({
+                    "step": step,
+                    "mode": "Iterative",
+                    "stage": "Budget",
+                    "server": "-",
+                    "rtt": None,
+                    "response": [f"NS lookup depth limit reached for {', '.join(ns_names)}"]
+                })
+                memo_failure = False
+                break
+
+            if not ns_ips:
+                def lookup(ns):
+                    sub_q = dns_wire.build_query(ns)
+                    sub_resp, sub_log, _, _ = iterative_resolve(sub_q, budget.nested())
+                    ips = []
+                    if sub_resp:
+                        for rr in dns_wire.parse_response(sub_resp).rr:
+                            if rr.rtype == 1:
+                                ips.append(str(rr.rdata))
+                    return ips, sub_log
+
+                ns_ips, sub_log = ns_lookup.first_ns_addresses(ns_names, lookup)
+                log.extend(sub_log)
+
+        if not ns_ips:
+            break
+
+        current_servers = ns_ips
+        current_zone = cut
+        # a concurrent resolution may already have cached a deeper cut
+        deeper, deeper_ips = CACHE.closest_delegation(qname)
+        if deeper and deeper.count(".") > current_zone.count("."):
+            current_servers, current_zone = deeper_ips, deeper
+
+    if response is None and memo_failure:
+        CACHE.put_failure(qname, qtype)
+    total_time = (time.time() - start_time) * 1000
+    return response, log, round(total_time, 2), qname
+
+
+def summarize(resp, data):
+    """Per-step log lines describing one upstream response."""
+    if not resolver_server.DETAILED_LOG:
+        return [f"{len(resp.rr)} answer, {len(resp.auth)} authority, {len(resp.ar)} additional records"]
+    full = DNSRecord.parse(data)
+    records = full.rr or full.auth or []
+    if not records:
+        return ["Referral or empty response"]
+    return [f"{rr.rname} -> {rr.rtype} -> {rr.rdata}" for rr in records]
+
+
+def forward(query_data, qname, qtype, zone, servers, budget, log, step):
+    """
+    Ask the forwarders of zone in turn, with recursion desired, until one
+    gives a usable answer. Steps are logged in "Recursive" mode. Returns
+    (response or None, last step number).
+    """
+    query = dns_wire.with_rd(query_data)
+    for server in servers:
+        step += 1
+        if not budget.spend():
+            log.append({
+                "step": step,
+                "mode": "Recursive",
+                "stage": "Budget",
+                "server": "-",
+                "rtt": None,
+                "response": ["Upstream query budget exhausted"]
+            })
+            break
+
+        data, rtt = upstream.exchange(query, server)
+        if data is None:
+            log.append({
+                "step": step,
+                "mode": "Recursive",
+                "stage": "Timeout",
+                "server": server,
+                "rtt": None,
+                "response": ["No response (timeout)"]
+            })
+            continue
+
+        resp = dns_wire.parse_response(data)
+        usable = forwarders.usable(resp)
+        log.append({
+            "step": step,
+            "mode": "Recursive",
+            "stage": "Forwarder",
+            "server": server,
+            "rtt": round(rtt, 2),
+            "response": summarize(resp, data) if usable else
+                        [f"Unusable reply (rcode {resp.rcode}), trying the next forwarder"]
+        })
+        METRICS.stage("Forwarder", rtt)
+        if usable:
+            CACHE.store_response(qname, qtype, resp, data, zone)
+            return data, step
+    return None, step
+
+
+def main(ask):
+    """Run a resolver whose steps query servers with ask (see the module docstring)."""
+    global ASK
+    ASK = ask
+    args = resolver_server.parse_args()
+    if args.root_servers:
+        ROOT_SERVERS[:] = args.root_servers
+    elif args.root_hints:
+        ROOT_SERVERS[:] = warmup.load_root_hints(args.root_hints)
+    resolver_server.serve(iterative_resolve, args, CACHE, PREFETCH)
+
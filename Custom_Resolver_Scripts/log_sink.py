@@ -0,0 +1,128 @@
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from trace_format import TraceWriter
+
+
+def format_query_log(record):
+    """
+    Render one query record as the text block written to the resolver log.
+    Built as a single string so concurrent workers never interleave lines.
+    """
+    lines = [f"\n[{record['time']}] Query from {record['client']} for {record['qname']}"]
+    for step_info in record["steps"]:
+        lines.append(f"  Step {step_info['step']} | Mode: {step_info['mode']} | "
+                     f"Stage: {step_info['stage']} | Server: {step_info['server']} | "
+                     f"RTT: {step_info['rtt']} ms")
+        lines.append("    Response:")
+        for line in step_info['response']:
+            lines.append(f"      {line}")
+        lines.append("")
+    lines.append(f"  Total resolution time: {record['total_ms']} ms")
+    if not record["success"]:
+        lines.append("  Resolution failed.\n")
+    return "\n".join(lines)
+
+
+class LogSink:
+    """
+    Resolver log backend that keeps file I/O off the request path. Workers
+    only enqueue records; a writer thread renders them and writes what has
+    accumulated at most every flush_interval seconds.
+    fmt is "text" (the classic per-step log) or "json" (one JSON object
+    per query, steps included). Each write is a single unbuffered append,
+    so several processes can share one log file without their records
+    interleaving. With fmt "trace", path is a directory: queries go to the
+    binary trace (see trace_format.py) and notes to notes.txt in it.
+    """
+
+    def __init__(self, path, fmt="text", flush_interval=1.0, echo=True):
+        self.fmt = fmt
+        self.flush_interval = flush_interval
+        self.echo = echo
+        self.trace = None
+        if fmt == "trace":
+            os.makedirs(path, exist_ok=True)
+            self.trace_path = path
+            path = os.path.join(path, "notes.txt")
+        self.file = open(path, "ab", buffering=0)
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def query(self, record):
+        """Log one resolved query (dict with time/client/qname/steps/total_ms/success)."""
+        self.queue.put(record)
+
+    def note(self, text):
+        """Log a free-form status line such as the run header."""
+        self.queue.put(text)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _render(self, item):
+        if isinstance(item, str):
+            if self.fmt == "json":
+                return json.dumps({"time": time.strftime("%Y-%m-%d %H:%M:%S"), "note": item.strip()})
+            return item
+        if self.fmt == "json":
+            return json.dumps(item)
+        return format_query_log(item)
+
+    def _run(self):
+        last_flush = time.monotonic()
+        closing = False
+        pending = []
+        while not closing:
+            timeout = max(self.flush_interval - (time.monotonic() - last_flush), 0.01)
+            try:
+                batch = [self.queue.get(timeout=timeout)]
+            except queue.Empty:
+                batch = []
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                closing = True
+                batch = batch[:batch.index(None)]
+
+            if self.fmt == "trace":
+                for item in batch:
+                    if isinstance(item, str):
+                        self._write(item + "\n")
+                    else:
+                        # created on the first query, so a notes-only sink
+                        # (the pre-fork parent) leaves no empty trace behind
+                        self.trace = self.trace or TraceWriter(self.trace_path)
+                        self.trace.add(item)
+                if self.echo and batch:
+                    pending.append("\n".join(self._render(item) for item in batch) + "\n")
+            elif batch:
+                pending.append("\n".join(self._render(item) for item in batch) + "\n")
+            if closing or time.monotonic() - last_flush >= self.flush_interval:
+                if self.trace:
+                    self.trace.flush()
+                if pending:
+                    out = "".join(pending)
+                    pending = []
+                    if self.fmt != "trace":
+                        self._write(out)
+                    if self.echo:
+                        sys.stdout.write(out)
+                        sys.stdout.flush()
+                last_flush = time.monotonic()
+        if self.trace:
+            self.trace.close()
+        self.file.close()
+
+    def _write(self, out):
+        data = out.encode()
+        while data:
+            data = data[self.file.write(data):]
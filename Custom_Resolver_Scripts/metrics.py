@@ -0,0 +1,174 @@
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+UPSTREAM_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16, 24, 32)
+STAGES = ("Root", "TLD", "Authoritative", "Forwarder")
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram. observe() is a bisect and two additions with no
+    lock: under heavy contention an increment can be lost, which is an
+    acceptable error for monitoring and keeps the per-query cost well under
+    a microsecond.
+    """
+
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def render(self, name, labels=""):
+        lines = []
+        total = 0
+        sep = "," if labels else ""
+        for bound, count in zip(self.bounds + ("+Inf",), self.counts):
+            total += count
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {total}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum:.3f}")
+        lines.append(f"{name}_count{suffix} {total}")
+        return lines
+
+
+class Metrics:
+    """
+    Live resolver counters. The listener calls query() once per client
+    query and the resolve loop calls stage() per answered upstream step and
+    upstream_queries() per top-level resolution; everything else (cache
+    and prefetch counters, per-server timeouts, rejected upstream
+    datagrams, queue depth) is read from the objects that already keep
+    it, only when the metrics are scraped.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.queries = {"udp": 0, "tcp": 0}
+        self.answered = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.latency = Histogram(LATENCY_BUCKETS_MS)
+        self.stages = {stage: Histogram(LATENCY_BUCKETS_MS) for stage in STAGES}
+        self.upstream = Histogram(UPSTREAM_BUCKETS)
+
+    def query(self, transport, total_ms, answered):
+        self.queries[transport] += 1
+        if answered:
+            self.answered += 1
+        else:
+            self.failed += 1
+        self.latency.observe(total_ms)
+
+    def stage(self, stage, rtt):
+        hist = self.stages.get(stage)
+        if hist is not None:
+            hist.observe(rtt)
+
+    def upstream_queries(self, count):
+        self.upstream.observe(count)
+
+    def render(self, cache=None, servers=(), queue_depth=None, clients=(), prefetcher=None,
+               rejected=None):
+        """Everything in the Prometheus text exposition format."""
+        out = []
+
+        def metric(name, kind, help_text, samples):
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(samples)
+
+        metric("dnsr_uptime_seconds", "gauge", "Seconds since the resolver started.",
+               [f"dnsr_uptime_seconds {time.time() - self.started:.1f}"])
+        metric("dnsr_client_queries_total", "counter", "Client queries received.",
+               [f'dnsr_client_queries_total{{transport="{t}"}} {n}' for t, n in self.queries.items()])
+        metric("dnsr_client_responses_total", "counter", "Client queries by outcome.",
+               [f'dnsr_client_responses_total{{result="answered"}} {self.answered}',
+                f'dnsr_client_responses_total{{result="servfail"}} {self.failed}'])
+        metric("dnsr_query_duration_ms", "histogram", "Client query resolution time.",
+               self.latency.render("dnsr_query_duration_ms"))
+        samples = []
+        for stage, hist in self.stages.items():
+            samples.extend(hist.render("dnsr_stage_rtt_ms", f'stage="{stage}"'))
+        metric("dnsr_stage_rtt_ms", "histogram", "Upstream RTT per resolution stage.", samples)
+        metric("dnsr_upstream_queries_per_query", "histogram",
+               "Upstream queries spent on one client query, nested NS lookups included.",
+               self.upstream.render("dnsr_upstream_queries_per_query"))
+        metric("dnsr_in_flight", "gauge", "Client queries accepted and not yet answered.",
+               [f"dnsr_in_flight {self.in_flight}"])
+        if queue_depth is not None:
+            metric("dnsr_queue_depth", "gauge", "Queries waiting for a worker thread.",
+                   [f"dnsr_queue_depth {queue_depth}"])
+        if cache is not None:
+            metric("dnsr_cache_lookups_total", "counter", "Answer cache lookups by result.",
+                   [f'dnsr_cache_lookups_total{{result="hit"}} {cache.hits}',
+                    f'dnsr_cache_lookups_total{{result="miss"}} {cache.misses}',
+                    f'dnsr_cache_lookups_total{{result="stale"}} {cache.stale_hits}'])
+            metric("dnsr_nxdomain_synthesized_total", "counter",
+                   "NXDOMAIN answers synthesized from a cached ancestor (RFC 8020).",
+                   [f"dnsr_nxdomain_synthesized_total {cache.synthesized}"])
+            metric("dnsr_cache_entries", "gauge", "Entries in the resolver cache.",
+                   [f"dnsr_cache_entries {len(cache)}"])
+        if prefetcher is not None:
+            metric("dnsr_prefetch_total", "counter", "Refreshes started for hot answers close to expiry.",
+                   [f"dnsr_prefetch_total {prefetcher.prefetched}"])
+            metric("dnsr_stale_served_total", "counter",
+                   "Expired answers served while they were refreshed (RFC 8767).",
+                   [f"dnsr_stale_served_total {prefetcher.stale_served}"])
+        rows = list(servers)
+        metric("dnsr_upstream_sent_total", "counter", "Queries sent per upstream server.",
+               [f'dnsr_upstream_sent_total{{server="{s}"}} {q}' for s, q, _, _ in rows])
+        metric("dnsr_upstream_timeouts_total", "counter", "Timeouts per upstream server.",
+               [f'dnsr_upstream_timeouts_total{{server="{s}"}} {t}' for s, _, t, _ in rows])
+        metric("dnsr_upstream_srtt_ms", "gauge", "Smoothed RTT per upstream server.",
+               [f'dnsr_upstream_srtt_ms{{server="{s}"}} {srtt:.2f}'
+                for s, _, _, srtt in rows if srtt is not None])
+        if rejected is not None:
+            metric("dnsr_upstream_rejected_total", "counter",
+                   "Upstream datagrams dropped as malformed or not matching an outstanding query.",
+                   [f"dnsr_upstream_rejected_total {rejected}"])
+        if clients:
+            metric("dnsr_client_delayed_total", "counter", "Queries held back by the client's rate limit.",
+                   [f'dnsr_client_delayed_total{{client="{c}"}} {d}' for c, _, d, _ in clients])
+            metric("dnsr_client_dropped_total", "counter", "Queries dropped by rate limit or queue cap.",
+                   [f'dnsr_client_dropped_total{{client="{c}"}} {x}' for c, _, _, x in clients])
+        return "\n".join(out) + "\n"
+
+
+METRICS = Metrics()
+
+
+def serve_http(bind, port, render):
+    """
+    Answer GET /metrics on (bind, port) from a daemon thread with the text
+    returned by render(). Returns the server.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # scrapes would drown the resolver output
+
+    server = ThreadingHTTPServer((bind, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
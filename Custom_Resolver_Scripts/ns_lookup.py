@@ -0,0 +1,113 @@
+import threading
+import time
+
+MAX_DEPTH = 4
+MAX_QUERIES = 40
+# Resolve up to this many glueless NS names at once and go on with the
+# first one that answers; 1 tries them lazily one after another.
+PARALLEL = 1
+# Longest a batch of parallel NS-name lookups is waited for, in seconds
+LOOKUP_TIMEOUT = 10
+
+
+class Budget:
+    """
+    Work limits for one client query. Nested NS-name lookups get a child
+    budget one level deeper that shares the same upstream-query allowance,
+    so a delegation cycle runs out of depth or queries instead of recursing
+    without bound. `path` holds the (qname, qtype) keys being resolved
+    further up the chain.
+    """
+
+    def __init__(self, max_depth=None, max_queries=None):
+        self.depth = 0
+        self.path = ()
+        self.max_depth = MAX_DEPTH if max_depth is None else max_depth
+        self.max_queries = MAX_QUERIES if max_queries is None else max_queries
+        self.left = [self.max_queries]
+        self.lock = threading.Lock()
+
+    def nested(self):
+        child = Budget(self.max_depth)
+        child.depth = self.depth + 1
+        child.path = self.path
+        child.max_queries = self.max_queries
+        child.left = self.left
+        child.lock = self.lock
+        return child
+
+    def can_nest(self):
+        return self.depth < self.max_depth
+
+    def spend(self):
+        """Take one upstream query from the allowance; False once it is used up."""
+        with self.lock:
+            if self.left[0] <= 0:
+                return False
+            self.left[0] -= 1
+            return True
+
+    def used(self):
+        """Upstream queries spent so far by the whole chain."""
+        return self.max_queries - self.left[0]
+
+
+def _lookup_safely(lookup, ns):
+    """lookup(ns), with an exception turned into a failed attempt so the next name gets a turn."""
+    try:
+        return lookup(ns)
+    except Exception as e:
+        return [], [{
+            "step": 1,
+            "mode": "Iterative",
+            "stage": "Error",
+            "server": "-",
+            "rtt": None,
+            "response": [f"Lookup of NS {ns} failed: {e!r}"]
+        }]
+
+
+def first_ns_addresses(ns_names, lookup):
+    """
+    Resolve glueless nameserver names until one yields addresses.
+    lookup(ns) -> (ips, log). Returns (ips, log) of the first name that
+    resolved, or ([], logs of every attempt) if none did. With PARALLEL > 1
+    the names are raced in batches; losers keep running in the background
+    and still fill the cache. A name whose lookup raises counts as failed,
+    and a batch that has not answered within LOOKUP_TIMEOUT is given up.
+    """
+    names = list(dict.fromkeys(ns_names))
+    if PARALLEL <= 1:
+        logs = []
+        for ns in names:
+            ips, log = _lookup_safely(lookup, ns)
+            if ips:
+                return ips, log
+            logs.extend(log)
+        return [], logs
+
+    def run(ns, results, done):
+        result = _lookup_safely(lookup, ns)
+        with done:
+            results.append(result)
+            done.notify()
+
+    logs = []
+    for i in range(0, len(names), PARALLEL):
+        batch = names[i:i + PARALLEL]
+        done = threading.Condition()
+        results = []
+        for ns in batch:
+            threading.Thread(target=run, args=(ns, results, done), daemon=True).start()
+        seen = 0
+        deadline = time.monotonic() + LOOKUP_TIMEOUT
+        with done:
+            while seen < len(batch):
+                if not done.wait_for(lambda: len(results) > seen, deadline - time.monotonic()):
+                    return [], logs
+                ips, log = results[seen]
+                seen += 1
+                if ips:
+                    return ips, log
+                logs.extend(log)
+    return [], logs
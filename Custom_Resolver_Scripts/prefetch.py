@@ -0,0 +1,105 @@
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+# Refresh a hot answer once less than this fraction of its TTL is left
+# (0 disables prefetching). Set by resolver_server.serve().
+THRESHOLD = 0.1
+# Queries within the popularity window that make a name "hot"
+HOT_HITS = 3
+# Background threads doing refreshes
+WORKERS = 2
+
+
+class PopularityCounter:
+    """
+    Approximate query counts per key in fixed memory: a count-min sketch of
+    `depth` rows by `width` counters. Every `window` additions all counters
+    are halved, so names that stop being asked for cool down again.
+    """
+
+    def __init__(self, width=4096, depth=4, window=50000):
+        self.width = width
+        self.depth = depth
+        self.window = window
+        self.rows = [array("I", bytes(4 * width)) for _ in range(depth)]
+        self.added = 0
+        self.lock = threading.Lock()
+
+    def _slots(self, key):
+        return [hash((i, key)) % self.width for i in range(self.depth)]
+
+    def add(self, key):
+        slots = self._slots(key)
+        with self.lock:
+            for row, j in zip(self.rows, slots):
+                row[j] += 1
+            self.added += 1
+            if self.added >= self.window:
+                self.added = 0
+                for row in self.rows:
+                    for j in range(self.width):
+                        row[j] >>= 1
+
+    def estimate(self, key):
+        slots = self._slots(key)
+        with self.lock:
+            return min(row[j] for row, j in zip(self.rows, slots))
+
+
+class Prefetcher:
+    """
+    Keeps hot answers warm. The resolve loop reports every cache hit to
+    consider(); expired answers served stale and popular answers close to
+    expiry are handed to `refresh(qname, qtype)` on a background pool, at
+    most one refresh per (qname, qtype) at a time.
+    """
+
+    def __init__(self, refresh, popularity=None):
+        self.refresh = refresh
+        self.popularity = popularity or PopularityCounter()
+        self.pool = None
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.prefetched = 0
+        self.stale_served = 0
+
+    def seen(self, key):
+        """Count one client query for key = (qname lower-cased, qtype)."""
+        self.popularity.add(key)
+
+    def consider(self, qname, qtype, remaining, ttl):
+        """
+        Decide whether a cache hit with `remaining` of `ttl` seconds left
+        needs refreshing. Returns "stale", "prefetch" or None.
+        """
+        if remaining <= 0:
+            self.stale_served += 1
+            self.submit(qname, qtype)
+            return "stale"
+        key = (qname.lower(), qtype)
+        if THRESHOLD and remaining < ttl * THRESHOLD and self.popularity.estimate(key) >= HOT_HITS:
+            if self.submit(qname, qtype):
+                self.prefetched += 1
+            return "prefetch"
+        return None
+
+    def submit(self, qname, qtype):
+        key = (qname.lower(), qtype)
+        with self.lock:
+            if key in self.pending:
+                return False
+            self.pending.add(key)
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(max_workers=WORKERS)
+        self.pool.submit(self._run, key, qname, qtype)
+        return True
+
+    def _run(self, key, qname, qtype):
+        try:
+            self.refresh(qname, qtype)
+        except Exception:
+            pass  # the cached copy stays; the next hit tries again
+        finally:
+            with self.lock:
+                self.pending.discard(key)
@@ -0,0 +1,153 @@
+import os
+import signal
+import socket
+import struct
+import sys
+import threading
+import time
+import traceback
+import zlib
+from multiprocessing import RawArray
+from dns_wire import question_name
+
+STAT_FIELDS = ["queries", "answered", "failed", "total_ms",
+               "cache_hits", "cache_misses", "stale_hits", "forwarded"]
+_FIELD = {name: i for i, name in enumerate(STAT_FIELDS)}
+
+
+class Worker:
+    """
+    A pre-forked serving process's view of the group: its index, its row in
+    the shared stats table and, when the cache is partitioned, one UNIX
+    datagram inbox per worker. Every qname has an owner worker (crc32 of
+    the name); the others hand its queries over, so each name is cached and
+    resolved in exactly one process and the owner replies to the client
+    from its own SO_REUSEPORT socket. Only this process writes its stats
+    row, but several of its threads may, so updates take a local lock.
+    """
+
+    def __init__(self, index, count, stats, inboxes):
+        self.index = index
+        self.count = count
+        self.stats = stats
+        self.base = index * len(STAT_FIELDS)
+        self.inboxes = inboxes
+        self.lock = threading.Lock()
+
+    def owner(self, data):
+        if not self.inboxes:
+            return self.index
+        qname = question_name(data)
+        if qname is None:
+            return self.index
+        return zlib.crc32(qname.encode()) % self.count
+
+    def forward(self, owner, data, addr):
+        header = socket.inet_aton(addr[0]) + struct.pack("!H", addr[1])
+        self.inboxes[owner][1].send(header + data)
+        self.add("forwarded")
+
+    def receive(self):
+        """Next (data, client addr) handed over by another worker."""
+        msg = self.inboxes[self.index][0].recv(65535)
+        return msg[6:], (socket.inet_ntoa(msg[:4]), struct.unpack_from("!H", msg, 4)[0])
+
+    def add(self, field, value=1):
+        with self.lock:
+            self.stats[self.base + _FIELD[field]] += value
+
+    def set(self, field, value):
+        with self.lock:
+            self.stats[self.base + _FIELD[field]] = value
+
+
+def totals(stats, count):
+    n = len(STAT_FIELDS)
+    return {name: sum(stats[w * n + i] for w in range(count)) for i, name in enumerate(STAT_FIELDS)}
+
+
+def format_stats(stats, count, elapsed):
+    t = totals(stats, count)
+    lookups = t["cache_hits"] + t["cache_misses"]
+    hit_ratio = t["cache_hits"] / lookups * 100 if lookups else 0.0
+    avg = t["total_ms"] / t["queries"] if t["queries"] else 0.0
+    return (f"[stats] {count} workers, {elapsed:.0f} s: {t['queries']:.0f} queries "
+            f"({t['queries'] / elapsed if elapsed else 0:.1f} qps), {t['answered']:.0f} answered, "
+            f"{t['failed']:.0f} failed, cache hit ratio {hit_ratio:.1f}%, "
+            f"{t['stale_hits']:.0f} stale, {t['forwarded']:.0f} handed over, avg {avg:.2f} ms")
+
+
+def _stop(signum, frame):
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    raise KeyboardInterrupt
+
+
+def start(count, run_worker, partition=True):
+    """
+    Fork `count` workers, each calling run_worker(Worker). Workers ignore
+    SIGINT (the parent owns Ctrl-C) and stop on SIGTERM. Must be called
+    before the parent starts any threads. Returns (pids, stats).
+    """
+    stats = RawArray("d", count * len(STAT_FIELDS))
+    inboxes = []
+    if partition:
+        inboxes = [socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM) for _ in range(count)]
+    pids = []
+    for index in range(count):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, _stop)
+            try:
+                run_worker(Worker(index, count, stats, inboxes))
+            except KeyboardInterrupt:
+                pass
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                os._exit(code)
+        pids.append(pid)
+    return pids, stats
+
+
+def supervise(pids, stats, sink, interval):
+    """
+    Parent loop: write aggregated stats every `interval` seconds, pass
+    SIGUSR1 on to the workers, and on Ctrl-C/SIGTERM stop them all and log
+    the final totals.
+    """
+    started = time.monotonic()
+    alive = set(pids)
+
+    def relay(signum, frame):
+        for pid in alive:
+            os.kill(pid, signum)
+
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, relay)
+    signal.signal(signal.SIGTERM, _stop)
+    next_report = started + interval if interval > 0 else None
+    try:
+        while alive:
+            time.sleep(0.2)
+            for pid in list(alive):
+                if os.waitpid(pid, os.WNOHANG)[0]:
+                    alive.discard(pid)
+                    sink.note(f"\n  Worker process {pid} exited")
+            if next_report and time.monotonic() >= next_report:
+                sink.note(format_stats(stats, len(pids), time.monotonic() - started))
+                next_report += interval
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in alive:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in alive:
+            os.waitpid(pid, 0)
+        sink.note(format_stats(stats, len(pids), time.monotonic() - started))
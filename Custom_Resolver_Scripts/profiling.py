@@ -0,0 +1,134 @@
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from dns_wire import question_name
+
+
+class Profiler:
+    """
+    Profiles the resolver while it serves: mode "cprofile" runs every
+    client query under a per-thread cProfile.Profile and writes the merged
+    pstats file, mode "sample" snapshots all thread stacks every `interval`
+    seconds and writes folded stacks (flamegraph.pl / speedscope input).
+    Either way each query's wall time is split into CPU time of its
+    handler thread and the rest, which is time spent waiting on upstream
+    sockets and locks.
+
+    Profiling stops after `queries` queries or `seconds` seconds (0 = until
+    shutdown); the resolver keeps serving afterwards. report(text) receives
+    the summary line.
+    """
+
+    def __init__(self, path, report, mode="cprofile", seconds=0, queries=0, interval=0.005):
+        self.path = path
+        self.report = report
+        self.mode = mode
+        self.seconds = seconds
+        self.queries = queries
+        self.interval = interval
+        self.active = True
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.rows = []  # (qname, wall ms, cpu ms)
+        self.profiles = []
+        self.local = threading.local()
+        self.samples = Counter()
+        self.unprofiled = 0
+        if mode == "sample":
+            threading.Thread(target=self._sample, daemon=True).start()
+
+    def wrap(self, handle):
+        """handle(data, addr, reply) timed (and profiled) per query."""
+
+        def profiled(data, addr, reply=None):
+            if not self.active:
+                return handle(data, addr, reply)
+            profile = self._thread_profile() if self.mode == "cprofile" else None
+            wall, cpu = time.perf_counter(), time.thread_time()
+            if profile is not None:
+                # on 3.12+ only one profiler can be active at a time; queries
+                # overlapping a profiled one are timed but not profiled
+                try:
+                    profile.enable()
+                except ValueError:
+                    self.unprofiled += 1
+                    profile = None
+            try:
+                return handle(data, addr, reply)
+            finally:
+                if profile is not None:
+                    profile.disable()
+                row = (question_name(data) or "?", (time.perf_counter() - wall) * 1000,
+                       (time.thread_time() - cpu) * 1000)
+                with self.lock:
+                    self.rows.append(row)
+                    done = len(self.rows) == self.queries
+                if done or (self.seconds and time.monotonic() - self.started >= self.seconds):
+                    self.finish()
+
+        return profiled
+
+    def _thread_profile(self):
+        profile = getattr(self.local, "profile", None)
+        if profile is None:
+            profile = self.local.profile = cProfile.Profile()
+            with self.lock:
+                self.profiles.append(profile)
+        return profile
+
+    def _sample(self):
+        own = threading.get_ident()
+        while self.active:
+            time.sleep(self.interval)
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, "thread"))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def finish(self):
+        """Stop profiling, write the output files and report the summary (once)."""
+        with self.lock:
+            if not self.active:
+                return
+            self.active = False
+            rows = list(self.rows)
+        elapsed = time.monotonic() - self.started
+        written = []
+        if self.mode == "cprofile":
+            profiles = [p for p in self.profiles if p.getstats()]
+            if profiles:
+                stats = pstats.Stats(*profiles)
+                stats.dump_stats(self.path)
+                with open(self.path + ".txt", "w") as f:
+                    stats.stream = f
+                    stats.sort_stats("tottime").print_stats(30)
+                written += [self.path, self.path + ".txt"]
+        else:
+            with open(self.path, "w") as f:
+                for stack, count in sorted(self.samples.items()):
+                    f.write(f"{stack} {count}\n")
+            written.append(self.path)
+        with open(self.path + ".queries.tsv", "w") as f:
+            f.write("qname\twall_ms\tcpu_ms\twait_ms\n")
+            for qname, wall, cpu in rows:
+                f.write(f"{qname}\t{wall:.3f}\t{cpu:.3f}\t{max(wall - cpu, 0):.3f}\n")
+        written.append(self.path + ".queries.tsv")
+
+        n = len(rows) or 1
+        wall = sum(r[1] for r in rows) / n
+        cpu = sum(r[2] for r in rows) / n
+        skipped = f", {self.unprofiled} not profiled (overlapping)" if self.unprofiled else ""
+        self.report(f"\n[profile] {len(rows)} queries in {elapsed:.1f} s{skipped}: avg wall {wall:.2f} ms "
+                    f"= CPU {cpu:.2f} ms + network/lock wait {max(wall - cpu, 0):.2f} ms "
+                    f"({cpu / wall * 100 if wall else 0:.0f}% CPU); wrote {', '.join(written)}")
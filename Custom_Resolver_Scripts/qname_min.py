@@ -0,0 +1,43 @@
+import dns_wire
+from resolver_cache import zone_chain
+
+# Send each server only the labels it needs to see (RFC 9156). Set by
+# resolver_server.serve().
+ENABLED = False
+# Minimised queries one resolution may send before it asks for the full
+# name (RFC 9156 MAX_MINIMISE_COUNT), so very deep names cannot run long
+MAX_MINIMISE = 10
+# Type of the minimised queries; RFC 9156 recommends A over NS because
+# fewer broken servers mishandle it
+QTYPE = dns_wire.QTYPE_A
+
+
+def next_name(cache, qname, zone):
+    """
+    The name to ask zone's servers about next: qname cut down to one label
+    below zone, skipping labels the cache knows are not zone cuts. None
+    when that is qname itself, i.e. the full query should be sent.
+    """
+    chain = zone_chain(qname.lower())
+    zone = zone.lower()
+    below = chain[:chain.index(zone)] if zone in chain else chain
+    for name in reversed(below[1:]):
+        if cache.get_delegation(name) != []:
+            return name
+    return None
+
+
+def learn(cache, name, resp):
+    """
+    Record that name is not a zone cut: the servers of the zone above it
+    answered for it instead of referring. Skipped for a name already
+    cached as a cut (the answer came from its own servers) and when the
+    answer came from name's own zone (parent and child served by the same
+    servers), which makes name an apex after all.
+    """
+    soa = [rr for rr in resp.auth if rr.rtype == dns_wire.QTYPE_SOA]
+    if cache.get_delegation(name) or any(rr.rname.lower() == name for rr in soa):
+        return
+    ttls = [rr.ttl for rr in resp.rr] or [min(rr.ttl, int(rr.rdata.split()[-1])) for rr in soa]
+    if ttls:
+        cache.put_no_cut(name, min(ttls))
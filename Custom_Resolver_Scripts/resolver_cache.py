@@ -0,0 +1,291 @@
+import threading
+import time
+from collections import OrderedDict
+from dns_wire import RCODE_NXDOMAIN, adjust_ttls, is_negative, synthesize_nxdomain
+from zone_trie import ZoneTrie
+
+QTYPE_A = 1
+QTYPE_NS = 2
+QTYPE_SOA = 6
+
+# Cap on how long NXDOMAIN/NODATA answers are kept (RFC 2308 suggests 1-3 h)
+NEGATIVE_MAX_TTL = 3600
+# How long a failed resolution (timeouts, lame servers) is remembered
+FAILURE_TTL = 5
+# Seconds an expired answer is kept and may still be served (RFC 8767
+# serve-stale; 0 = off), and the TTL stale answers go out with
+SERVE_STALE = 0
+STALE_ANSWER_TTL = 30
+# Answer names below a cached NXDOMAIN with NXDOMAIN too (RFC 8020)
+AGGRESSIVE_NXDOMAIN = False
+
+
+def zone_chain(qname):
+    """
+    Enclosing zones of qname from the most specific one up to (not
+    including) the root, e.g. "www.example.com." -> ["www.example.com.",
+    "example.com.", "com."].
+    """
+    labels = qname.rstrip(".").split(".")
+    if labels == [""]:
+        return []
+    return [".".join(labels[i:]) + "." for i in range(len(labels))]
+
+
+def in_zone(name, zone):
+    """Whether name is zone itself or below it (case-insensitive)."""
+    name, zone = name.lower(), zone.lower()
+    return zone == "." or name == zone or name.endswith("." + zone)
+
+
+def referral(qname, resp, zone):
+    """
+    The delegations in a response from a server of `zone` to a query for
+    qname that can be trusted: NS sets owned by an ancestor of qname
+    strictly below zone, and A glue for their nameservers whose owner lies
+    inside zone, the server's own bailiwick; sibling glue such as
+    ns.other.net in a .net referral for example.net is kept. Returns
+    ({zone: (ns names, ttl)}, {lower-cased host: (ips, ttl)}).
+    """
+    ancestors = set(zone_chain(qname.lower()))
+    cuts = {}
+    for rr in resp.auth:
+        if rr.rtype == QTYPE_NS:
+            cut = rr.rname.lower()
+            if cut not in ancestors or cut == zone.lower() or not in_zone(cut, zone):
+                continue  # sideways or upward referral, don't trust it
+            names, ttl = cuts.get(cut, ([], rr.ttl))
+            names.append(str(rr.rdata))
+            cuts[cut] = (names, min(ttl, rr.ttl))
+
+    nameservers = {ns.lower() for names, _ in cuts.values() for ns in names}
+    glue = {}
+    for rr in resp.ar:
+        host = rr.rname.lower()
+        if rr.rtype == QTYPE_A and host in nameservers and in_zone(host, zone):
+            ips, ttl = glue.get(host, ([], rr.ttl))
+            ips.append(str(rr.rdata))
+            glue[host] = (ips, min(ttl, rr.ttl))
+    return cuts, glue
+
+
+class ResolverCache:
+    """
+    TTL-aware LRU cache shared by the resolver scripts. It holds these
+    kinds of entries in one bounded OrderedDict:
+    - ("answer", qname, qtype): raw final response bytes, including
+      NXDOMAIN/NODATA responses held for their negative TTL
+    - ("failure", qname, qtype): marker for a recent failed resolution
+    - ("glue", host): A addresses of a nameserver host
+    Nameserver names learned from referrals live in a separate ZoneTrie
+    (zones), so the closest cached zone cut of a name is one trie walk. An
+    empty NS list there marks a name known not to be a zone cut. With
+    AGGRESSIVE_NXDOMAIN, names answered NXDOMAIN are also kept in a trie
+    (nxdomains) so a cached NXDOMAIN covers every name below it.
+    """
+
+    def __init__(self, max_entries=10000, max_ttl=86400, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.zones = ZoneTrie(max_entries, clock)
+        self.nxdomains = ZoneTrie(max_entries, clock)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.synthesized = 0
+
+    def __len__(self):
+        return len(self.entries) + len(self.zones) + len(self.nxdomains)
+
+    def _get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expiry, value = entry
+            if expiry <= self.clock():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def _put(self, key, value, ttl, grace=0):
+        ttl = min(ttl, self.max_ttl)
+        if ttl <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (self.clock() + ttl + grace, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def lookup_answer(self, qname, qtype, query_id=None):
+        """
+        Return (response, remaining, ttl) for (qname, qtype), or None.
+        The response has its TTLs decremented by the time spent in cache
+        and, if query_id is given, the header ID rewritten so the packet can
+        go straight back to the client. remaining <= 0 marks an expired
+        answer kept for serve-stale; its records all carry STALE_ANSWER_TTL.
+        """
+        entry = self._get(("answer", qname.lower(), qtype))
+        if entry is None:
+            self.misses += 1
+            return None
+        expiry, (data, stored_at, ttl) = entry
+        age = self.clock() - stored_at
+        if age >= ttl:
+            self.stale_hits += 1
+            return adjust_ttls(data, 1 << 32, query_id, STALE_ANSWER_TTL), ttl - age, ttl
+        self.hits += 1
+        return adjust_ttls(data, int(age), query_id), ttl - age, ttl
+
+    def put_answer(self, qname, qtype, data, ttl):
+        ttl = min(ttl, self.max_ttl)
+        self._put(("answer", qname.lower(), qtype), (data, self.clock(), ttl), ttl, SERVE_STALE)
+
+    def get_failure(self, qname, qtype):
+        return self._get(("failure", qname.lower(), qtype)) is not None
+
+    def put_failure(self, qname, qtype, ttl=None):
+        self._put(("failure", qname.lower(), qtype), True, FAILURE_TTL if ttl is None else ttl)
+
+    def get_delegation(self, zone):
+        return self.zones.get(zone)
+
+    def put_delegation(self, zone, ns_names, ttl):
+        self.zones.put(zone, list(ns_names), min(ttl, self.max_ttl))
+
+    def put_no_cut(self, name, ttl):
+        """Remember that name is inside its parent's zone, not delegated."""
+        self.zones.put(name, [], min(ttl, self.max_ttl))
+
+    def nxdomain_ancestor(self, qname, query_data):
+        """
+        (ancestor, NXDOMAIN reply to query_data) when qname or a name above
+        it is cached as NXDOMAIN, so qname cannot exist either (RFC 8020);
+        None otherwise or without AGGRESSIVE_NXDOMAIN.
+        """
+        if not AGGRESSIVE_NXDOMAIN:
+            return None
+        found = self.nxdomains.enclosing(qname)
+        if not found:
+            return None
+        name, (data, stored_at) = found[0]
+        self.synthesized += 1
+        return name, synthesize_nxdomain(query_data, data, int(self.clock() - stored_at))
+
+    def get_glue(self, host):
+        entry = self._get(("glue", host.lower()))
+        return entry[1] if entry else None
+
+    def put_glue(self, host, ips, ttl):
+        if ips:
+            self._put(("glue", host.lower()), list(ips), ttl)
+
+    def export(self):
+        """
+        Every live entry except failure markers as (key, remaining, value)
+        with times relative to now, oldest first, for a snapshot. Answers
+        carry (data, age, ttl) and NXDOMAIN names (data, age) instead of
+        their stored_at timestamp.
+        """
+        now = self.clock()
+        out = []
+        with self.lock:
+            for key, (expiry, value) in self.entries.items():
+                if key[0] == "failure" or expiry <= now:
+                    continue
+                if key[0] == "answer":
+                    data, stored_at, ttl = value
+                    value = (data, now - stored_at, ttl)
+                out.append((key, expiry - now, value))
+        out.extend((("ns", zone), remaining, value) for zone, value, remaining in self.zones.items())
+        out.extend((("nxdomain", name), remaining, (data, now - stored_at))
+                   for name, (data, stored_at), remaining in self.nxdomains.items())
+        return out
+
+    def restore(self, entries, elapsed=0.0):
+        """
+        Load entries from export() taken `elapsed` seconds ago. Remaining
+        lifetimes and answer ages are moved on by that much, so restored
+        answers go out with correctly decremented TTLs; whatever expired
+        in the meantime is skipped. Returns the number of entries loaded.
+        """
+        now = self.clock()
+        loaded = 0
+        with self.lock:
+            for key, remaining, value in entries:
+                remaining -= elapsed
+                if remaining <= 0:
+                    continue
+                if key[0] == "ns":
+                    self.zones.put(key[1], value, remaining)
+                    loaded += 1
+                    continue
+                if key[0] == "nxdomain":
+                    data, age = value
+                    self.nxdomains.put(key[1], (data, now - age - elapsed), remaining)
+                    loaded += 1
+                    continue
+                if key[0] == "answer":
+                    data, age, ttl = value
+                    value = (data, now - age - elapsed, ttl)
+                self.entries[key] = (now + remaining, value)
+                self.entries.move_to_end(key)
+                loaded += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return loaded
+
+    def closest_delegation(self, qname):
+        """
+        Return (zone, ips) for the deepest cached zone cut enclosing qname
+        whose nameserver addresses are also cached. Returns (None, None)
+        when only the root is known.
+        """
+        for zone, ns_names in self.zones.enclosing(qname):
+            if zone == ".":
+                break
+            ips = []
+            for ns in ns_names:
+                ips.extend(self.get_glue(ns) or [])
+            if ips:
+                return zone, ips
+        return None, None
+
+    def store_response(self, qname, qtype, resp, data, zone):
+        """
+        Learn everything cacheable from one parsed upstream response from a
+        server of `zone`: the final answer (positive or negative), and the
+        NS referral and glue that referral() accepts.
+        """
+        if resp.rr:
+            ttl = min(rr.ttl for rr in resp.rr)
+            self.put_answer(qname, qtype, data, ttl)
+            addrs = [str(rr.rdata) for rr in resp.rr if rr.rtype == QTYPE_A]
+            if qtype == QTYPE_A and addrs:
+                self.put_glue(qname, addrs, ttl)
+            return
+
+        ancestors = set(zone_chain(qname.lower()))
+        if is_negative(resp):
+            # RFC 2308: negative TTL is the lesser of the SOA's own TTL and
+            # its MINIMUM field; without an in-bailiwick SOA don't cache
+            ttls = [min(rr.ttl, int(rr.rdata.split()[-1])) for rr in resp.auth
+                    if rr.rtype == QTYPE_SOA and in_zone(rr.rname, zone)
+                    and (rr.rname.lower() in ancestors or rr.rname == ".")]
+            if ttls:
+                ttl = min(min(ttls), NEGATIVE_MAX_TTL)
+                self.put_answer(qname, qtype, data, ttl)
+                if AGGRESSIVE_NXDOMAIN and resp.rcode == RCODE_NXDOMAIN:
+                    self.nxdomains.put(qname, (data, self.clock()), min(ttl, self.max_ttl))
+            return
+
+        cuts, glue = referral(qname, resp, zone)
+        for cut, (names, ttl) in cuts.items():
+            self.put_delegation(cut, names, ttl)
+        for host, (ips, ttl) in glue.items():
+            self.put_glue(host, ips, ttl)
@@ -0,0 +1,421 @@
+import argparse
+import os
+import signal
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from log_sink import LogSink
+from metrics import METRICS
+from profiling import Profiler
+import dns_wire
+import fair_queue
+import forwarders
+import metrics
+import ns_lookup
+import prefetch
+import prefork
+import qname_min
+import resolver_cache
+import upstream
+import warmup
+
+# Render every upstream RR in the per-step log; --brief-log turns this off
+# so the resolve loop never has to build a full DNSRecord.
+DETAILED_LOG = True
+# Client TCP connections: idle timeout (seconds) and how many may be open
+TCP_IDLE_TIMEOUT = 10
+TCP_MAX_CLIENTS = 64
+
+
+def parse_weight(spec):
+    ip, _, weight = spec.partition("=")
+    return ip.strip(), float(weight)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Iterative DNS resolver (DNSR)")
+    parser.add_argument("log_file", nargs="?", default="resolver_log.txt")
+    parser.add_argument("--bind", default="10.0.0.5", help="listen address")
+    parser.add_argument("--port", type=int, default=53, help="listen port")
+    parser.add_argument("--root-servers", type=lambda s: s.split(","), metavar="IP,IP,...",
+                        help="override the built-in ROOT_SERVERS (e.g. a local test hierarchy)")
+    parser.add_argument("--root-hints", nargs="?", const=warmup.ROOT_HINTS, metavar="FILE",
+                        help="take the root servers from a named.root file (default: the bundled one)")
+    parser.add_argument("--prewarm", type=int, default=0, metavar="N",
+                        help="at startup, look up the delegations of the N most queried TLDs")
+    parser.add_argument("--prewarm-from", nargs="+", metavar="CSV",
+                        help="query CSVs to rank TLDs by (default: Extarcted_Queries/*.csv)")
+    parser.add_argument("--cache-snapshot", metavar="FILE",
+                        help="reload the cache from FILE at startup and save it there on shutdown")
+    parser.add_argument("--snapshot-interval", type=float, default=300, metavar="SECONDS",
+                        help="also save the cache snapshot this often (0 = only on shutdown)")
+    parser.add_argument("--forwarders", nargs="+", metavar="IP",
+                        help="forward every query (RD set) to this pool of recursive resolvers, "
+                             "falling back to iterative resolution when none answers")
+    parser.add_argument("--forward-zone", action="append", default=[], type=forwarders.parse_zone,
+                        metavar="ZONE=IP,IP",
+                        help="forward only names under ZONE to these resolvers (repeatable)")
+    parser.add_argument("--forwarder-health", type=float, default=10.0, metavar="SECONDS",
+                        help="how often every forwarder is probed (0 = never)")
+    parser.add_argument("--upstream-port", type=int, default=53,
+                        help="port upstream nameservers listen on")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="client queries resolved concurrently (1 = serial loop)")
+    parser.add_argument("--fair-queue", action="store_true",
+                        help="serve clients in weighted fair order instead of arrival order")
+    parser.add_argument("--rate-limit", type=float, default=0, metavar="QPS",
+                        help="per-client token bucket rate (0 = unlimited); implies --fair-queue")
+    parser.add_argument("--rate-burst", type=int, default=20,
+                        help="queries a client may send at once before --rate-limit applies")
+    parser.add_argument("--rate-max-delay", type=float, default=1.0, metavar="SECONDS",
+                        help="longest an over-rate query is held for a token before being dropped")
+    parser.add_argument("--client-queue", type=int, default=100,
+                        help="queries one client may have waiting before more are dropped")
+    parser.add_argument("--client-weight", action="append", default=[], type=parse_weight,
+                        metavar="IP=WEIGHT", help="give a client a larger or smaller share (repeatable)")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="pre-fork N worker processes sharing the port via SO_REUSEPORT")
+    parser.add_argument("--private-caches", action="store_true",
+                        help="with --processes, let every worker cache everything instead of "
+                             "partitioning names between workers")
+    parser.add_argument("--stats-interval", type=float, default=10.0, metavar="SECONDS",
+                        help="with --processes, how often aggregated stats are logged (0 = only at exit)")
+    parser.add_argument("--metrics-port", type=int, default=0, metavar="PORT",
+                        help="serve Prometheus metrics over HTTP on this port (0 = off); "
+                             "with --processes, worker N uses PORT + N")
+    parser.add_argument("--metrics-bind", default="127.0.0.1",
+                        help="address for the metrics endpoint")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="profile query handling and write pstats (or folded stacks) to FILE, "
+                             "plus FILE.queries.tsv with each query's CPU / wait split")
+    parser.add_argument("--profile-mode", choices=["cprofile", "sample"], default="cprofile",
+                        help="deterministic cProfile, or a low-overhead stack sampler across all threads")
+    parser.add_argument("--profile-seconds", type=float, default=0, metavar="SECONDS",
+                        help="stop profiling after this long (0 = at shutdown)")
+    parser.add_argument("--profile-queries", type=int, default=0, metavar="N",
+                        help="stop profiling after N queries (0 = at shutdown)")
+    parser.add_argument("--profile-interval", type=float, default=5.0, metavar="MS",
+                        help="sampling interval for --profile-mode sample")
+    parser.add_argument("--edns-payload", type=int, default=1232, metavar="BYTES",
+                        help="EDNS0 UDP payload size advertised upstream (0 = no EDNS)")
+    parser.add_argument("--no-tcp", action="store_true",
+                        help="do not listen for client queries over TCP")
+    parser.add_argument("--max-upstream", type=int, default=64,
+                        help="cap on in-flight upstream queries across all workers")
+    parser.add_argument("--race-stagger", type=float, default=None, metavar="MS",
+                        help="race NS candidates, starting the next one after MS ms")
+    parser.add_argument("--brief-log", action="store_true",
+                        help="log record counts per step instead of every RR")
+    parser.add_argument("--ns-parallel", type=int, default=1, metavar="N",
+                        help="resolve up to N glueless NS names at once (1 = lazily, in order)")
+    parser.add_argument("--max-ns-depth", type=int, default=4,
+                        help="nesting limit for glueless NS-name lookups")
+    parser.add_argument("--max-queries", type=int, default=40,
+                        help="upstream queries allowed per client query")
+    parser.add_argument("--negative-max-ttl", type=int, default=3600, metavar="SECONDS",
+                        help="cap on how long NXDOMAIN/NODATA answers are cached")
+    parser.add_argument("--servfail-ttl", type=float, default=5, metavar="SECONDS",
+                        help="how long a failed resolution is answered with SERVFAIL from cache (0 = off)")
+    parser.add_argument("--prefetch-threshold", type=float, default=0.1, metavar="FRACTION",
+                        help="refresh hot answers once less than this share of their TTL is left (0 = off)")
+    parser.add_argument("--prefetch-hits", type=int, default=3,
+                        help="recent queries that make a name hot enough to prefetch")
+    parser.add_argument("--serve-stale", type=int, default=0, metavar="SECONDS",
+                        help="keep expired answers this long and serve them while refreshing (RFC 8767)")
+    parser.add_argument("--qname-minimisation", action="store_true",
+                        help="send each server only the labels it needs (RFC 9156), caching "
+                             "the zone cuts found for every intermediate name")
+    parser.add_argument("--aggressive-nxdomain", action="store_true",
+                        help="answer names below a cached NXDOMAIN from cache (RFC 8020)")
+    parser.add_argument("--log-format", choices=["text", "json", "trace"], default="text",
+                        help="per-step text blocks, one JSON line per query, or a binary trace "
+                             "directory (log_file names the directory; render with trace_format.py)")
+    parser.add_argument("--flush-interval", type=float, default=1.0, metavar="SECONDS",
+                        help="how often the log writer flushes (0 = after every batch)")
+    parser.add_argument("--no-echo", action="store_true",
+                        help="do not mirror the log to stdout")
+    return parser.parse_args()
+
+
+def serve(iterative_resolve, args, cache=None, prefetcher=None):
+    """
+    Configure the resolver modules from args and answer queries until
+    interrupted: in this process, or with --processes N in N pre-forked
+    workers sharing the listen address via SO_REUSEPORT.
+    """
+    upstream.UPSTREAM_LIMIT = threading.BoundedSemaphore(args.max_upstream)
+    upstream.UPSTREAM_PORT = args.upstream_port
+    upstream.EDNS_PAYLOAD = args.edns_payload
+    if args.race_stagger is not None:
+        upstream.RACE_STAGGER = args.race_stagger / 1000
+    global DETAILED_LOG
+    DETAILED_LOG = not args.brief_log
+    ns_lookup.PARALLEL = args.ns_parallel
+    ns_lookup.MAX_DEPTH = args.max_ns_depth
+    ns_lookup.MAX_QUERIES = args.max_queries
+    resolver_cache.NEGATIVE_MAX_TTL = args.negative_max_ttl
+    resolver_cache.FAILURE_TTL = args.servfail_ttl
+    resolver_cache.SERVE_STALE = args.serve_stale
+    resolver_cache.AGGRESSIVE_NXDOMAIN = args.aggressive_nxdomain
+    qname_min.ENABLED = args.qname_minimisation
+    prefetch.THRESHOLD = args.prefetch_threshold
+    prefetch.HOT_HITS = args.prefetch_hits
+    forwarders.configure(args.forwarders, args.forward_zone)
+    forwarders.HEALTH_INTERVAL = args.forwarder_health
+    fair_queue.RATE = args.rate_limit
+    fair_queue.BURST = args.rate_burst
+    fair_queue.MAX_DELAY = args.rate_max_delay
+    fair_queue.CLIENT_QUEUE = args.client_queue
+    fair_queue.WEIGHTS = dict(args.client_weight)
+
+    if args.processes <= 1:
+        serve_worker(iterative_resolve, args, cache, prefetcher=prefetcher)
+        return
+
+    pids, stats = prefork.start(
+        args.processes, lambda worker: serve_worker(iterative_resolve, args, cache, worker, prefetcher),
+        partition=not args.private_caches)
+    sink = LogSink(args.log_file, args.log_format, args.flush_interval, not args.no_echo)
+    sink.note(f"\n===== New Run at {time.strftime('%Y-%m-%d %H:%M:%S')} =====")
+    sink.note(f"DNS Listener running on DNSR (port {args.port}) with {args.processes} worker "
+              f"processes, {'private' if args.private_caches else 'partitioned'} caches ...")
+    try:
+        prefork.supervise(pids, stats, sink, args.stats_interval)
+    finally:
+        sink.close()
+
+
+def serve_worker(iterative_resolve, args, cache=None, worker=None, prefetcher=None):
+    """
+    The listen loop. worker is the prefork.Worker this process runs as,
+    or None when it serves alone.
+    """
+    log_file = args.log_file
+    if args.log_format == "trace" and worker is not None:
+        # one trace per process; the readers merge the worker subdirectories
+        log_file = os.path.join(log_file, f"worker{worker.index}")
+    sink = LogSink(log_file, args.log_format, args.flush_interval, not args.no_echo)
+    if worker is None:
+        sink.note(f"\n===== New Run at {time.strftime('%Y-%m-%d %H:%M:%S')} =====")
+        sink.note(f"DNS Listener running on DNSR (port {args.port}) ...")
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if worker is not None:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((args.bind, args.port))
+    tcp_sock = None
+    if not args.no_tcp:
+        tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        tcp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if worker is not None:
+            tcp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        tcp_sock.bind((args.bind, args.port))
+        tcp_sock.listen(TCP_MAX_CLIENTS)
+    forwarders.start_health_checks()
+    snapshot = None
+    if args.cache_snapshot and cache is not None:
+        snapshot = worker_path(args.cache_snapshot, worker)
+        loaded = warmup.load_snapshot(cache, snapshot)
+        sink.note(f"Restored {loaded} cache entries from {snapshot}")
+        if args.snapshot_interval > 0:
+            warmup.start_snapshots(cache, snapshot, args.snapshot_interval)
+    if args.prewarm:
+        def prewarm():
+            started = time.monotonic()
+            tlds = warmup.top_tlds(args.prewarm, args.prewarm_from)
+            warmed = warmup.prewarm(lambda q: iterative_resolve(q, ns_lookup.Budget())[0], tlds)
+            sink.note(f"Pre-warmed {warmed}/{len(tlds)} TLD delegations in "
+                      f"{time.monotonic() - started:.1f} s")
+
+        threading.Thread(target=prewarm, daemon=True).start()
+    fair = fair_queue.FairQueue() if args.fair_queue or args.rate_limit else None
+    if hasattr(signal, "SIGUSR1"):
+        # `kill -USR1 <pid>` dumps the upstream server (and client) tables
+        # into the log. The handler may interrupt the main thread while it
+        # holds the server-table or log locks, so it only wakes a dumper
+        # thread; nothing else ever takes that event's lock.
+        dump_requested = threading.Event()
+
+        def dump_tables():
+            while True:
+                dump_requested.wait()
+                dump_requested.clear()
+                sink.note("\n" + upstream.format_server_table() + ("\n" + fair.format_table() if fair else ""))
+
+        threading.Thread(target=dump_tables, daemon=True).start()
+        signal.signal(signal.SIGUSR1, lambda *_: dump_requested.set())
+
+    def handle(data, addr, reply=None):
+        recv_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+        response, log, total, qname = iterative_resolve(data)
+        METRICS.query("udp" if reply is None else "tcp", total, response is not None)
+        # answer failures right away rather than leaving the client to time out
+        out = response or dns_wire.error_response(data, dns_wire.RCODE_SERVFAIL)
+        if reply is not None:
+            reply(out)
+        else:
+            sock.sendto(dns_wire.fit_udp(out, data, upstream.EDNS_PAYLOAD or 512), addr)
+        success = bool(response) and dns_wire.answer_count(response) > 0
+        sink.query({
+            "time": recv_time,
+            "client": addr[0],
+            "qname": qname,
+            "steps": log,
+            "total_ms": total,
+            "success": success
+        })
+        if worker is not None:
+            worker.add("queries")
+            worker.add("answered" if response else "failed")
+            worker.add("total_ms", total)
+            if cache is not None:
+                worker.set("cache_hits", cache.hits)
+                worker.set("cache_misses", cache.misses)
+                worker.set("stale_hits", cache.stale_hits)
+
+    profiler = None
+    if args.profile:
+        profiler = Profiler(worker_path(args.profile, worker), sink.note, args.profile_mode, args.profile_seconds,
+                            args.profile_queries, args.profile_interval / 1000)
+        handle = profiler.wrap(handle)
+
+    def answer_error(data, addr, reply, rcode):
+        """Reply with rcode and no records, if the question can be read at all."""
+        if dns_wire.question_name(data) is None:
+            return
+        out = dns_wire.error_response(data, rcode)
+        try:
+            if reply is not None:
+                reply(out)
+            else:
+                sock.sendto(out, addr)
+        except OSError:
+            pass
+
+    def handle_safely(data, addr, reply=None):
+        if not dns_wire.is_query(data):
+            return  # never answer a response: that could bounce between resolvers forever
+        if dns_wire.opcode(data) != dns_wire.OPCODE_QUERY:
+            answer_error(data, addr, reply, dns_wire.RCODE_NOTIMP)
+            return
+        METRICS.in_flight += 1
+        try:
+            handle(data, addr, reply)
+        except Exception as e:
+            sink.note(f"\n  Error handling query from {addr[0]}: {e!r}")
+            # still answer, so the client does not wait out its timeout
+            answer_error(data, addr, reply, dns_wire.RCODE_SERVFAIL)
+        finally:
+            METRICS.in_flight -= 1
+
+    pool = None
+    if fair:
+        # the fair queue has its own worker threads, so one flooding
+        # client only ever backs up its own queue
+        def fair_worker():
+            while True:
+                handle_safely(*fair.get())
+
+        for _ in range(args.workers):
+            threading.Thread(target=fair_worker, daemon=True).start()
+    elif args.workers > 1:
+        pool = ThreadPoolExecutor(max_workers=args.workers)
+    serial = threading.Lock()
+
+    if args.metrics_port:
+        port = args.metrics_port + (worker.index if worker is not None else 0)
+        metrics.serve_http(args.metrics_bind, port, lambda: METRICS.render(
+            cache, upstream.server_counters(),
+            fair.depth() if fair else pool._work_queue.qsize() if pool else None,
+            fair.counters() if fair else (), prefetcher, upstream.rejected_replies()))
+        sink.note(f"Metrics on http://{args.metrics_bind}:{port}/metrics")
+
+    def dispatch(data, addr):
+        if fair:
+            fair.put(addr[0], (data, addr))
+        elif pool:
+            pool.submit(handle_safely, data, addr)
+        else:
+            with serial:
+                handle_safely(data, addr)
+
+    def inbox_loop():
+        while True:
+            dispatch(*worker.receive())
+
+    tcp_slots = threading.BoundedSemaphore(TCP_MAX_CLIENTS)
+
+    def tcp_client(conn, addr):
+        # length-prefixed queries (RFC 7766), answered in order; TCP
+        # queries are resolved here even if another worker owns the name
+        def reply(response):
+            conn.sendall(struct.pack("!H", len(response)) + response)
+
+        try:
+            with conn:
+                conn.settimeout(TCP_IDLE_TIMEOUT)
+                while True:
+                    header = recv_exactly(conn, 2)
+                    data = header and recv_exactly(conn, struct.unpack("!H", header)[0])
+                    if not data:
+                        break
+                    handle_safely(data, addr, reply)
+        except OSError:
+            pass
+        finally:
+            tcp_slots.release()
+
+    def tcp_accept_loop():
+        while True:
+            conn, addr = tcp_sock.accept()
+            if not tcp_slots.acquire(blocking=False):
+                conn.close()
+                continue
+            threading.Thread(target=tcp_client, args=(conn, addr), daemon=True).start()
+
+    if worker is not None and worker.inboxes:
+        threading.Thread(target=inbox_loop, daemon=True).start()
+    if tcp_sock is not None:
+        threading.Thread(target=tcp_accept_loop, daemon=True).start()
+
+    try:
+        while True:
+            data, addr = sock.recvfrom(4096)
+            if not dns_wire.is_query(data):
+                continue
+            if worker is not None:
+                owner = worker.owner(data)
+                if owner != worker.index:
+                    worker.forward(owner, data, addr)
+                    continue
+            dispatch(data, addr)
+    finally:
+        if pool:
+            pool.shutdown()
+        if profiler:
+            profiler.finish()
+        if fair:
+            sink.note("\n" + fair.format_table())
+        if snapshot:
+            sink.note(f"Saved {warmup.save_snapshot(cache, snapshot)} cache entries to {snapshot}")
+        sink.close()
+
+
+def worker_path(path, worker):
+    """path for this process: name.workerN.ext for pre-forked workers."""
+    if worker is None:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.worker{worker.index}{ext}"
+
+
+def recv_exactly(conn, n):
+    """Read n bytes from a stream socket; None if it closes first."""
+    buf = b""
+    while len(buf) < n:
+        chunk = conn.recv(n - len(buf))
+        if not chunk:
+            return None
+        buf += chunk
+    return buf
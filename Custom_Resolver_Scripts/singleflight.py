@@ -0,0 +1,57 @@
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into one: the first caller
+    runs fn(), everyone who arrives while it is running waits and gets the
+    same result, or the same exception if fn() raised. `coalesced` counts the callers that did not run fn().
+    Callers must not join a key they are themselves resolving.
+    """
+
+    def __init__(self, wait_timeout=10):
+        self.wait_timeout = wait_timeout
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """Return (result, shared), shared being True if another caller ran fn()."""
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+            else:
+                leader = _Call()
+                self.calls[key] = leader
+
+        if call is not None:
+            # the timeout breaks cross-thread waits on each other's keys
+            if call.done.wait(self.wait_timeout):
+                if call.error is not None:
+                    raise call.error
+                return call.result, True
+            with self.lock:
+                self.coalesced -= 1
+            return fn(), False
+
+        try:
+            leader.result = fn()
+            return leader.result, False
+        except BaseException as e:
+            leader.error = e
+            raise
+        finally:
+            with self.lock:
+                if self.calls.get(key) is leader:
+                    del self.calls[key]
+            leader.done.set()
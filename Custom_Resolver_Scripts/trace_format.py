@@ -0,0 +1,178 @@
+"""
+Compact binary resolver trace: the per-query log as fixed-width records
+instead of text blocks. A trace is a directory of three append-only files:
+
+  strings.bin  dictionary of every distinct string (qnames, servers,
+               stages, clients, timestamps, response summaries), each a
+               little-endian uint16 length + UTF-8 bytes; a string's id
+               is its position in the file
+  steps.bin    one 24-byte STEP record per resolution step
+  queries.bin  one 24-byte QUERY record per client query; its steps are
+               steps[first_step:first_step + nsteps]
+
+Records are written strings first, then steps, then queries, so a reader
+never sees a query whose steps or strings are missing. Fixed widths mean
+the two tables can be memory-mapped straight into NumPy arrays.
+
+Usage: python trace_format.py <trace_dir> [--limit N]   (renders as text)
+"""
+import os
+import struct
+
+QUERY = struct.Struct("<IIIfBBHI")  # time, client, qname, total_ms, success, -, nsteps, first_step
+STEP = struct.Struct("<IHHHHIfI")   # query, step, mode, stage, -, server, rtt, response
+QUERY_DTYPE = [("time", "<u4"), ("client", "<u4"), ("qname", "<u4"), ("total_ms", "<f4"),
+               ("success", "u1"), ("pad", "u1"), ("nsteps", "<u2"), ("first_step", "<u4")]
+STEP_DTYPE = [("query", "<u4"), ("step", "<u2"), ("mode", "<u2"), ("stage", "<u2"), ("pad", "<u2"),
+              ("server", "<u4"), ("rtt", "<f4"), ("response", "<u4")]
+NAN = float("nan")
+
+
+def read_strings(path):
+    """All complete strings in a strings.bin, and the byte length they cover."""
+    strings = []
+    with open(path, "rb") as f:
+        data = f.read()
+    pos = 0
+    while pos + 2 <= len(data):
+        n = struct.unpack_from("<H", data, pos)[0]
+        if pos + 2 + n > len(data):
+            break
+        strings.append(data[pos + 2:pos + 2 + n].decode("utf-8", "replace"))
+        pos += 2 + n
+    return strings, pos
+
+
+class TraceWriter:
+    """
+    Appends resolver query records (the dicts LogSink receives) to a trace
+    directory. add() only encodes into memory; flush() writes everything
+    pending with one append per file. Reopening an existing trace resumes
+    its string ids and record numbering, dropping any torn tail.
+    """
+
+    def __init__(self, path):
+        os.makedirs(path, exist_ok=True)
+        self.paths = {name: os.path.join(path, name + ".bin") for name in ("strings", "steps", "queries")}
+        for p in self.paths.values():
+            open(p, "ab").close()
+
+        strings, valid = read_strings(self.paths["strings"])
+        self.ids = {s: i for i, s in enumerate(strings)}
+        os.truncate(self.paths["strings"], valid)
+        for name, record in (("steps", STEP), ("queries", QUERY)):
+            size = os.path.getsize(self.paths[name])
+            os.truncate(self.paths[name], size - size % record.size)
+        self.n_steps = os.path.getsize(self.paths["steps"]) // STEP.size
+        self.n_queries = os.path.getsize(self.paths["queries"]) // QUERY.size
+
+        self.files = {name: open(p, "ab", buffering=0) for name, p in self.paths.items()}
+        self.pending = {name: bytearray() for name in self.paths}
+
+    def _id(self, text):
+        text = "" if text is None else str(text)
+        sid = self.ids.get(text)
+        if sid is None:
+            raw = text.encode("utf-8")[:0xFFFF]
+            sid = self.ids[text] = len(self.ids)
+            self.pending["strings"] += struct.pack("<H", len(raw)) + raw
+        return sid
+
+    def add(self, record):
+        first_step = self.n_steps
+        for s in record["steps"]:
+            rtt = s.get("rtt")
+            self.pending["steps"] += STEP.pack(
+                self.n_queries, s["step"], self._id(s["mode"]), self._id(s["stage"]), 0,
+                self._id(s["server"]), NAN if rtt is None else rtt, self._id("\n".join(s["response"])))
+            self.n_steps += 1
+        total = record.get("total_ms")
+        self.pending["queries"] += QUERY.pack(
+            self._id(record["time"]), self._id(record["client"]), self._id(record["qname"]),
+            NAN if total is None else total, bool(record["success"]), 0,
+            len(record["steps"]), first_step)
+        self.n_queries += 1
+
+    def flush(self):
+        for name in ("strings", "steps", "queries"):
+            data = self.pending[name]
+            while data:
+                data = data[self.files[name].write(data):]
+            self.pending[name] = bytearray()
+
+    def close(self):
+        self.flush()
+        for f in self.files.values():
+            f.close()
+
+
+def _map(path, dtype):
+    import numpy as np
+    dtype = np.dtype(dtype)
+    count = os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+
+
+def open_trace(path):
+    """
+    (queries, steps, strings) for one trace directory: the two record
+    tables as read-only memory-mapped NumPy arrays, and the string table.
+    Records that reference strings or steps not yet on disk are cut off.
+    """
+    strings, _ = read_strings(os.path.join(path, "strings.bin"))
+    queries = _map(os.path.join(path, "queries.bin"), QUERY_DTYPE)
+    steps = _map(os.path.join(path, "steps.bin"), STEP_DTYPE)
+    complete = (queries["first_step"].astype("u8") + queries["nsteps"]) <= len(steps)
+    n = len(queries) if complete.all() else int(complete.argmin())
+    return queries[:n], steps, strings
+
+
+def trace_dirs(path):
+    """path itself if it is a trace, else its trace subdirectories (one per pre-forked worker)."""
+    if os.path.exists(os.path.join(path, "queries.bin")):
+        return [path]
+    return sorted(os.path.join(path, d) for d in os.listdir(path)
+                  if os.path.exists(os.path.join(path, d, "queries.bin")))
+
+
+def iter_records(path):
+    """Decode a trace back into the dicts the resolver logged (slow; for rendering)."""
+    for trace in trace_dirs(path):
+        queries, steps, strings = open_trace(trace)
+        for q in queries:
+            record_steps = []
+            for s in steps[q["first_step"]:q["first_step"] + q["nsteps"]]:
+                rtt = float(s["rtt"])
+                record_steps.append({
+                    "step": int(s["step"]),
+                    "mode": strings[s["mode"]],
+                    "stage": strings[s["stage"]],
+                    "server": strings[s["server"]],
+                    "rtt": None if rtt != rtt else round(rtt, 2),
+                    "response": strings[s["response"]].split("\n"),
+                })
+            total = float(q["total_ms"])
+            yield {
+                "time": strings[q["time"]],
+                "client": strings[q["client"]],
+                "qname": strings[q["qname"]],
+                "steps": record_steps,
+                "total_ms": None if total != total else round(total, 2),
+                "success": bool(q["success"]),
+            }
+
+
+if __name__ == "__main__":
+    import argparse
+    from log_sink import format_query_log
+
+    parser = argparse.ArgumentParser(description="Render a binary resolver trace as the text log")
+    parser.add_argument("trace_dir")
+    parser.add_argument("--limit", type=int, help="only the first N queries")
+    args = parser.parse_args()
+    for i, record in enumerate(iter_records(args.trace_dir)):
+        if args.limit is not None and i >= args.limit:
+            break
+        print(format_query_log(record))
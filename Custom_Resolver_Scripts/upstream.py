@@ -0,0 +1,517 @@
+import random
+import select
+import socket
+import struct
+import threading
+import time
+from dns_wire import (RCODE_FORMERR, RCODE_NOERROR, RCODE_NXDOMAIN, question_name, truncated,
+                      with_edns)
+
+# How long one upstream exchange waits for an answer in all (seconds);
+# within that, a query is retransmitted each time the server's RTO runs out.
+TIMEOUT = 2
+UPSTREAM_PORT = 53
+# Seconds to wait before racing the next candidate server; None disables
+# racing and each step talks to one server at a time.
+RACE_STAGGER = None
+RACE_MAX_PARALLEL = 3
+DEFAULT_SRTT = 100.0
+SOCKET_POOL_SIZE = 8
+# UDP payload size advertised in an EDNS0 OPT record on every upstream
+# query (0 = plain DNS, 512-byte answers). 1232 avoids IP fragmentation.
+EDNS_PAYLOAD = 1232
+# Seconds an upstream TCP connection stays open with nothing outstanding
+TCP_IDLE = 10.0
+
+# Retransmit timeout bounds (seconds), RFC 6298 style: RTO = SRTT + 4 *
+# RTTVAR, starting at INITIAL_RTO for servers we have never heard from.
+INITIAL_RTO = 1.0
+MIN_RTO = 0.2
+# Consecutive timeouts before a server goes into the penalty box; each
+# further timeout doubles the time it is skipped, up to PENALTY_MAX.
+PENALTY_THRESHOLD = 2
+PENALTY_BASE = 5.0
+PENALTY_MAX = 300.0
+
+# Caps how many upstream exchanges may be outstanding at once across all
+# worker threads. Replaced by resolver_server.serve() from --max-upstream.
+UPSTREAM_LIMIT = threading.BoundedSemaphore(64)
+
+
+class ServerStats:
+    """RTT estimator and failure state for one upstream server (RTTs in ms, RTO in s)."""
+
+    __slots__ = ("srtt", "rttvar", "rto", "timeouts", "penalty_until",
+                 "queries", "answers", "total_timeouts")
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = INITIAL_RTO
+        self.timeouts = 0  # consecutive
+        self.penalty_until = 0.0
+        self.queries = 0
+        self.answers = 0
+        self.total_timeouts = 0
+
+
+_servers = {}
+_servers_lock = threading.Lock()
+
+
+def _stats(server):
+    stats = _servers.get(server)
+    if stats is None:
+        stats = _servers[server] = ServerStats()
+    return stats
+
+
+def record_rtt(server, rtt):
+    """
+    Fold one RTT sample (ms) into the server's SRTT and RTTVAR (RFC 6298,
+    alpha = 1/8, beta = 1/4) and clear its timeout streak.
+    """
+    with _servers_lock:
+        stats = _stats(server)
+        if stats.srtt is None:
+            stats.srtt, stats.rttvar = rtt, rtt / 2
+        else:
+            stats.rttvar += (abs(stats.srtt - rtt) - stats.rttvar) / 4
+            stats.srtt += (rtt - stats.srtt) / 8
+        stats.rto = min(max((stats.srtt + 4 * stats.rttvar) / 1000, MIN_RTO), TIMEOUT)
+        stats.timeouts = 0
+        stats.penalty_until = 0.0
+        stats.queries += 1
+        stats.answers += 1
+
+
+def record_timeout(server):
+    """Back the server's RTO off (Karn) and penalise it after repeated timeouts."""
+    with _servers_lock:
+        stats = _stats(server)
+        stats.rto = min(stats.rto * 2, TIMEOUT)
+        stats.timeouts += 1
+        stats.queries += 1
+        stats.total_timeouts += 1
+        if stats.timeouts >= PENALTY_THRESHOLD:
+            backoff = PENALTY_BASE * 2 ** (stats.timeouts - PENALTY_THRESHOLD)
+            stats.penalty_until = time.monotonic() + min(backoff, PENALTY_MAX)
+
+
+def server_rto(server):
+    """Seconds to wait for this server before retransmitting or trying another one."""
+    with _servers_lock:
+        stats = _servers.get(server)
+        return stats.rto if stats else INITIAL_RTO
+
+
+def order_servers(servers):
+    """
+    Best candidates first: servers without a recent timeout before those
+    with one, then by smoothed RTT (never-tried servers rank at
+    DEFAULT_SRTT). Servers in the penalty box are left out, unless every
+    candidate is in it, in which case the one released soonest comes first.
+    """
+    now = time.monotonic()
+    with _servers_lock:
+        def key(s):
+            stats = _servers.get(s)
+            if stats is None:
+                return 0, DEFAULT_SRTT
+            return stats.timeouts, stats.srtt if stats.srtt is not None else DEFAULT_SRTT
+
+        usable = [s for s in servers if s not in _servers or _servers[s].penalty_until <= now]
+        if not usable:
+            return sorted(servers, key=lambda s: _servers[s].penalty_until)
+        return sorted(usable, key=key)
+
+
+def healthy(servers):
+    """servers that are not in the penalty box, in the given order."""
+    now = time.monotonic()
+    with _servers_lock:
+        return [s for s in servers if s not in _servers or _servers[s].penalty_until <= now]
+
+
+def server_counters():
+    """(server, queries, timeouts, srtt ms or None) for every upstream server seen."""
+    with _servers_lock:
+        return [(server, st.queries, st.total_timeouts, st.srtt) for server, st in _servers.items()]
+
+
+def format_server_table():
+    """The upstream server table as text, slowest RTO first."""
+    now = time.monotonic()
+    with _servers_lock:
+        rows = sorted(_servers.items(), key=lambda item: -item[1].rto)
+        lines = [f"Upstream servers ({len(rows)}):",
+                 f"  {'Server':<18}{'SRTT ms':>9}{'RTTVAR':>9}{'RTO ms':>9}{'Queries':>9}"
+                 f"{'Timeouts':>10}{'Streak':>8}  Penalty"]
+        for server, st in rows:
+            srtt = f"{st.srtt:.1f}" if st.srtt is not None else "-"
+            rttvar = f"{st.rttvar:.1f}" if st.rttvar is not None else "-"
+            penalty = f"{st.penalty_until - now:.0f}s left" if st.penalty_until > now else "-"
+            lines.append(f"  {server:<18}{srtt:>9}{rttvar:>9}{st.rto * 1000:>9.0f}{st.queries:>9}"
+                         f"{st.total_timeouts:>10}{st.timeouts:>8}  {penalty}")
+    return "\n".join(lines)
+
+
+class _Pending:
+    def __init__(self, key, server, qname, original_id, done):
+        self.key = key
+        self.server = server
+        self.qname = qname
+        self.original_id = original_id
+        self.done = done
+        self.data = None
+        self.send_time = None
+        self.recv_time = None
+
+
+class UpstreamTransport:
+    """
+    Long-lived UDP transport shared by every upstream query. It owns a small
+    pool of sockets bound to random ephemeral ports; each query goes out on
+    a random one with a fresh random ID, and a receiver thread hands replies
+    back to the waiting query keyed by (ID, server, qname). Anything that
+    does not match an outstanding query is dropped and counted in `rejected`.
+    """
+
+    def __init__(self, pool_size=SOCKET_POOL_SIZE):
+        self.sockets = []
+        for _ in range(pool_size):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(("", 0))
+            sock.setblocking(False)
+            self.sockets.append(sock)
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.rejected = 0
+        self.rng = random.SystemRandom()
+        threading.Thread(target=self._receive_loop, daemon=True).start()
+
+    def send(self, query_data, server, done=None, edns=True):
+        """
+        Send query_data to server and return a handle whose `done` event is
+        set once a matching reply has arrived in handle.data. With edns the
+        query goes out with our own OPT record instead of the client's.
+        """
+        if edns and EDNS_PAYLOAD:
+            query_data = with_edns(query_data, EDNS_PAYLOAD)
+        qname = question_name(query_data)
+        original_id = query_data[:2]
+        with self.lock:
+            while True:
+                qid = self.rng.randrange(65536)
+                key = (qid, server, qname)
+                if key not in self.pending:
+                    break
+            handle = _Pending(key, server, qname, original_id, done or threading.Event())
+            self.pending[key] = handle
+        handle.send_time = time.time()
+        sock = self.rng.choice(self.sockets)
+        try:
+            sock.sendto(struct.pack("!H", qid) + query_data[2:], (server, UPSTREAM_PORT))
+        except OSError:
+            self.cancel(handle)
+            handle.done.set()
+        return handle
+
+    def cancel(self, handle):
+        with self.lock:
+            if self.pending.get(handle.key) is handle:
+                del self.pending[handle.key]
+
+    def _receive_loop(self):
+        while True:
+            readable, _, _ = select.select(self.sockets, [], [], 1.0)
+            for sock in readable:
+                try:
+                    data, addr = sock.recvfrom(65535)
+                except OSError:
+                    continue
+                self._dispatch(data, addr)
+
+    def _dispatch(self, data, addr):
+        if len(data) < 12 or not data[2] & 0x80 or addr[1] != UPSTREAM_PORT:
+            self.rejected += 1
+            return
+        qid = struct.unpack_from("!H", data)[0]
+        key = (qid, addr[0], question_name(data))
+        with self.lock:
+            handle = self.pending.pop(key, None)
+        if handle is None:
+            self.rejected += 1
+            return
+        handle.recv_time = time.time()
+        handle.data = handle.original_id + data[2:]
+        handle.done.set()
+
+
+class TcpConnection:
+    """
+    A TCP connection to one upstream server, reused by every TCP query to
+    it while it stays open. Queries are pipelined: each is written as soon
+    as it is sent and a reader thread matches replies by (ID, qname) in
+    whatever order they come back (RFC 7766). The connection closes itself
+    after TCP_IDLE seconds with nothing outstanding.
+    """
+
+    def __init__(self, server, timeout):
+        self.server = server
+        self.sock = socket.create_connection((server, UPSTREAM_PORT), timeout)
+        self.sock.settimeout(TCP_IDLE)
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.closed = False
+        self.rng = random.SystemRandom()
+        threading.Thread(target=self._read_loop, daemon=True).start()
+
+    def send(self, query_data):
+        qname = question_name(query_data)
+        with self.lock:
+            if self.closed:
+                raise ConnectionError("connection closed")
+            while True:
+                qid = self.rng.randrange(65536)
+                key = (qid, qname)
+                if key not in self.pending:
+                    break
+            handle = _Pending(key, self.server, qname, query_data[:2], threading.Event())
+            self.pending[key] = handle
+        handle.send_time = time.time()
+        try:
+            with self.write_lock:
+                self.sock.sendall(struct.pack("!HH", len(query_data), qid) + query_data[2:])
+        except OSError:
+            self.close()
+        return handle
+
+    def cancel(self, handle):
+        with self.lock:
+            if self.pending.get(handle.key) is handle:
+                del self.pending[handle.key]
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            waiting, self.pending = self.pending, {}
+        self.sock.close()
+        for handle in waiting.values():
+            handle.done.set()
+
+    def _read_exactly(self, n, idle_ok=False):
+        buf = b""
+        while len(buf) < n:
+            try:
+                chunk = self.sock.recv(n - len(buf))
+            except socket.timeout:
+                if idle_ok and not buf:
+                    raise
+                continue
+            if not chunk:
+                raise ConnectionError("closed by server")
+            buf += chunk
+        return buf
+
+    def _read_loop(self):
+        try:
+            while True:
+                try:
+                    length = struct.unpack("!H", self._read_exactly(2, idle_ok=True))[0]
+                except socket.timeout:
+                    with self.lock:
+                        if not self.pending:
+                            break
+                    continue
+                data = self._read_exactly(length)
+                key = (struct.unpack_from("!H", data)[0], question_name(data))
+                with self.lock:
+                    handle = self.pending.pop(key, None)
+                if handle is not None:
+                    handle.recv_time = time.time()
+                    handle.data = handle.original_id + data[2:]
+                    handle.done.set()
+        except (OSError, struct.error):
+            pass
+        finally:
+            self.close()
+
+
+_tcp_connections = {}
+_tcp_lock = threading.Lock()
+
+
+def tcp_connection(server, timeout):
+    """The open TCP connection to server, connecting if there is none."""
+    with _tcp_lock:
+        conn = _tcp_connections.get(server)
+    if conn is None or conn.closed:
+        conn = TcpConnection(server, timeout)
+        with _tcp_lock:
+            _tcp_connections[server] = conn
+    return conn
+
+
+def tcp_exchange(query_data, server, timeout=TIMEOUT):
+    """
+    Send one query to server over (a reused) TCP connection and wait for
+    the reply. Returns (data, rtt_ms), or (None, None) on failure.
+    """
+    for attempt in range(2):
+        try:
+            with UPSTREAM_LIMIT:
+                conn = tcp_connection(server, timeout)
+                handle = conn.send(query_data)
+                handle.done.wait(timeout)
+                conn.cancel(handle)
+        except OSError:
+            return None, None
+        if handle.data is not None:
+            return handle.data, (handle.recv_time - handle.send_time) * 1000
+        if not conn.closed:
+            return None, None
+        # the server had dropped the idle connection; retry on a fresh one
+    return None, None
+
+
+def _complete(query_data, server, data, rtt):
+    """A truncated UDP reply is retried over TCP; no usable answer gives (None, None)."""
+    if not truncated(data):
+        return data, rtt
+    tcp_data, tcp_rtt = tcp_exchange(query_data, server)
+    if tcp_data is None:
+        return None, None
+    return tcp_data, rtt + tcp_rtt
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = UpstreamTransport()
+        return _transport
+
+
+def rejected_replies():
+    """Datagrams the shared transport dropped as malformed or unsolicited."""
+    return _transport.rejected if _transport is not None else 0
+
+
+def exchange(query_data, server, timeout=TIMEOUT, edns=True):
+    """
+    Send one query to server and wait up to `timeout` seconds for the
+    reply. Each time the server's RTO runs out the query is sent again
+    under a new ID, with the RTO doubled, and a reply to any of the copies
+    counts; each copy's RTT is measured from its own send, so the sample
+    is unambiguous. A truncated reply is fetched again over TCP and a
+    server that rejects EDNS with FORMERR is asked again without it.
+    Returns (data, rtt_ms), or (None, None) on timeout.
+    """
+    deadline = time.time() + timeout
+    rto = server_rto(server)
+    transport = get_transport()
+    done = threading.Event()
+    handles = []
+    winner = None
+    with UPSTREAM_LIMIT:
+        while winner is None:
+            left = deadline - time.time()
+            if left <= 0:
+                break
+            handles.append(transport.send(query_data, server, done, edns=edns))
+            done.wait(min(rto, left))
+            done.clear()
+            winner = next((h for h in handles if h.data is not None), None)
+            rto = min(rto * 2, TIMEOUT)
+        for handle in handles:
+            transport.cancel(handle)
+    if winner is None:
+        record_timeout(server)
+        return None, None
+    rtt = (winner.recv_time - winner.send_time) * 1000
+    record_rtt(server, rtt)
+    if edns and EDNS_PAYLOAD and winner.data[3] & 0x0F == RCODE_FORMERR:
+        return exchange(query_data, server, max(deadline - time.time(), server_rto(server)), edns=False)
+    return _complete(query_data, server, winner.data, rtt)
+
+
+def race_query(query_data, servers, timeout=None, stagger=None):
+    """
+    Happy-eyeballs style exchange: send to the first server, then to the
+    next one every `stagger` seconds until one answers. The first NOERROR
+    or NXDOMAIN reply wins; any other rcode sends the next candidate at
+    once and the race goes on, except that a FORMERR to our EDNS query is
+    asked again without it, as in exchange(). Returns (data, server,
+    rtt_ms, tried) where data is None when nobody answered before the
+    deadline (the first losing reply when only losing replies came back);
+    tried lists every server sent to.
+    The deadline is `timeout` (default TIMEOUT) from the first send; the
+    RTOs only decide the order the servers are tried in.
+    """
+    stagger = RACE_STAGGER if stagger is None else stagger
+    transport = get_transport()
+    candidates = list(servers[:RACE_MAX_PARALLEL])
+    done = threading.Event()
+    handles = []        # one per UPSTREAM_LIMIT slot taken
+    seen = set()        # handles whose reply has been looked at
+    plain = set()       # resends without EDNS
+    fallback = None
+    start = time.time()
+    deadline = start + (TIMEOUT if timeout is None else timeout)
+    next_send = start
+    winner = None
+
+    try:
+        while True:
+            now = time.time()
+            if candidates and now >= next_send:
+                server = candidates.pop(0)
+                # the first send may block for a slot; extras are skipped
+                # rather than queued when the resolver is saturated
+                if UPSTREAM_LIMIT.acquire(blocking=not handles):
+                    handles.append(transport.send(query_data, server, done))
+                next_send = now + stagger
+
+            for i, handle in enumerate(handles):
+                if handle.data is None or handle in seen:
+                    continue
+                seen.add(handle)
+                record_rtt(handle.server, (handle.recv_time - handle.send_time) * 1000)
+                rcode = handle.data[3] & 0x0F
+                if rcode in (RCODE_NOERROR, RCODE_NXDOMAIN):
+                    winner = handle
+                    break
+                if rcode == RCODE_FORMERR and EDNS_PAYLOAD and handle not in plain:
+                    # the resend takes over the slot of the rejected query
+                    handles[i] = transport.send(query_data, handle.server, done, edns=False)
+                    plain.add(handles[i])
+                    continue
+                fallback = fallback or handle
+                next_send = now
+            settled = all(h in seen for h in handles) and not candidates
+            if winner is not None or settled or now >= deadline:
+                break
+            wait_until = min(deadline, next_send) if candidates else deadline
+            done.wait(max(wait_until - now, 0))
+            done.clear()
+    finally:
+        for handle in handles:
+            transport.cancel(handle)
+            UPSTREAM_LIMIT.release()
+
+    tried = [h.server for h in handles]
+    for handle in handles:
+        if handle.data is None:
+            record_timeout(handle.server)
+    winner = winner or fallback
+    if winner is not None:
+        rtt = (winner.recv_time - winner.send_time) * 1000
+        data, rtt = _complete(query_data, winner.server, winner.data, rtt)
+        return data, winner.server, rtt, tried
+    return None, None, None, tried
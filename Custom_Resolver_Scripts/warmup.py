@@ -0,0 +1,115 @@
+"""
+Faster starts for the resolver: root hints from a named.root file, a
+background pre-warm of the TLD delegations the workload uses most, and a
+cache snapshot written periodically / on shutdown and reloaded at start.
+"""
+import base64
+import csv
+import glob
+import json
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import dns_wire
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT_HINTS = os.path.join(HERE, "named.root")
+QUERY_CSVS = os.path.join(HERE, "..", "Extarcted_Queries", "*.csv")
+SNAPSHOT_VERSION = 1
+
+
+def load_root_hints(path=ROOT_HINTS):
+    """
+    IPv4 addresses of the root servers listed in a named.root / root hints
+    file (the A records of the hosts named by the root NS records).
+    """
+    root_ns = []
+    addrs = {}
+    with open(path) as f:
+        for line in f:
+            fields = line.split(";", 1)[0].split()
+            if len(fields) < 4:
+                continue
+            name, rtype, rdata = fields[0].lower(), fields[-2].upper(), fields[-1]
+            if rtype == "NS" and name == ".":
+                root_ns.append(rdata.lower())
+            elif rtype == "A":
+                addrs.setdefault(name, []).append(rdata)
+    ips = [ip for ns in root_ns for ip in addrs.get(ns, [])]
+    if not ips:
+        raise ValueError(f"no root server addresses in {path}")
+    return ips
+
+
+def top_tlds(count, paths=None):
+    """The `count` most queried TLDs (e.g. "com.") in the query CSVs."""
+    tlds = Counter()
+    for path in paths or sorted(glob.glob(QUERY_CSVS)):
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            for row in csv.reader(f):
+                if len(row) > 1 and "." in row[1].strip("."):
+                    tlds[row[1].rstrip(".").rsplit(".", 1)[-1].lower() + "."] += 1
+    return [tld for tld, _ in tlds.most_common(count)]
+
+
+def prewarm(resolve, tlds, parallel=8):
+    """
+    Look up the NS set of every TLD with resolve(query_data), which leaves
+    the TLD delegations and their glue in the cache. Returns how many
+    lookups produced a response.
+    """
+    def one(tld):
+        return resolve(dns_wire.build_query(tld, dns_wire.QTYPE_NS)) is not None
+
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        return sum(pool.map(one, tlds))
+
+
+def save_snapshot(cache, path):
+    """Write the cache to path atomically (JSON, response bytes base64)."""
+    entries = []
+    for key, remaining, value in cache.export():
+        if key[0] in ("answer", "nxdomain"):
+            value = [base64.b64encode(value[0]).decode("ascii")] + list(value[1:])
+        entries.append([list(key), remaining, value])
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"version": SNAPSHOT_VERSION, "saved_at": time.time(), "entries": entries}, f)
+    os.replace(tmp, path)
+    return len(entries)
+
+
+def load_snapshot(cache, path):
+    """
+    Restore a snapshot written by save_snapshot(), ageing every entry by
+    the time since it was saved. Returns the number of entries loaded (0
+    when there is no usable snapshot).
+    """
+    try:
+        with open(path) as f:
+            snap = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    if snap.get("version") != SNAPSHOT_VERSION:
+        return 0
+    entries = []
+    for key, remaining, value in snap["entries"]:
+        if key[0] in ("answer", "nxdomain"):
+            value = (base64.b64decode(value[0]),) + tuple(value[1:])
+        entries.append((tuple(key), remaining, value))
+    return cache.restore(entries, max(time.time() - snap["saved_at"], 0.0))
+
+
+def start_snapshots(cache, path, interval):
+    """Save a snapshot every `interval` seconds from a daemon thread."""
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                save_snapshot(cache, path)
+            except OSError:
+                pass  # try again next interval; shutdown saves once more
+
+    threading.Thread(target=loop, daemon=True).start()
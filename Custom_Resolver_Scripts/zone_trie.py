@@ -0,0 +1,170 @@
+import sys
+import threading
+import time
+
+
+class _Node:
+    """
+    One label of the trie. value/expiry are set only where a zone is
+    stored; such nodes are also linked into the LRU list via prev/next.
+    """
+
+    __slots__ = ("label", "parent", "children", "value", "expiry", "prev", "next")
+
+    def __init__(self, label, parent):
+        self.label = label
+        self.parent = parent
+        self.children = None  # created on the first child
+        self.value = None
+        self.expiry = 0.0
+        self.prev = self.next = None
+
+
+def _labels(name):
+    """Labels of a domain name from the root down: "www.example.com." -> ["com", "example", "www"]."""
+    name = name.rstrip(".").lower()
+    return name.split(".")[::-1] if name else []
+
+
+class ZoneTrie:
+    """
+    Per-zone data (e.g. delegation NS sets) keyed by domain name in a trie
+    of reversed labels. Labels are interned, so the "com" under every path
+    is the same string object, and nodes use __slots__. The deepest stored
+    zone enclosing a name is found in one walk of O(labels).
+
+    Every stored zone has its own expiry. At most max_entries zones are
+    kept and the least recently used one is evicted beyond that, along
+    with any interior nodes it leaves empty. The LRU order is a linked list
+    threaded through the nodes themselves, which costs two slots per node
+    instead of an OrderedDict entry.
+    """
+
+    def __init__(self, max_entries=100000, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.clock = clock
+        self.root = _Node("", None)
+        self.lru = _Node("", None)  # sentinel: lru.next is the least recently used
+        self.lru.prev = self.lru.next = self.lru
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def _unlink(self, node):
+        node.prev.next = node.next
+        node.next.prev = node.prev
+        node.prev = node.next = None
+
+    def _touch(self, node):
+        """Move node to the most recently used end, linking it in if new."""
+        if node.prev is not None:
+            self._unlink(node)
+        else:
+            self.count += 1
+        tail = self.lru.prev
+        tail.next = node
+        node.prev = tail
+        node.next = self.lru
+        self.lru.prev = node
+
+    def _find(self, name, create=False):
+        node = self.root
+        for label in _labels(name):
+            children = node.children
+            child = children.get(label) if children else None
+            if child is None:
+                if not create:
+                    return None
+                label = sys.intern(label)
+                child = _Node(label, node)
+                if children is None:
+                    children = node.children = {}
+                children[label] = child
+            node = child
+        return node
+
+    def _drop(self, node):
+        """Forget node's value and prune the branch above it if nothing else hangs there."""
+        node.value = None
+        if node.prev is not None:
+            self._unlink(node)
+            self.count -= 1
+        while node.parent is not None and node.value is None and not node.children:
+            parent = node.parent
+            del parent.children[node.label]
+            if not parent.children:
+                parent.children = None
+            node = parent
+
+    @staticmethod
+    def _name(node):
+        labels = []
+        while node.parent is not None:
+            labels.append(node.label)
+            node = node.parent
+        return ".".join(labels) + "." if labels else "."
+
+    def put(self, name, value, ttl):
+        if ttl <= 0:
+            return
+        with self.lock:
+            node = self._find(name, create=True)
+            node.value = value
+            node.expiry = self.clock() + ttl
+            self._touch(node)
+            while self.count > self.max_entries:
+                self._drop(self.lru.next)
+
+    def get(self, name):
+        """The live value stored for exactly this zone, or None."""
+        with self.lock:
+            node = self._find(name)
+            if node is None or node.value is None:
+                return None
+            if node.expiry <= self.clock():
+                self._drop(node)
+                return None
+            self._touch(node)
+            return node.value
+
+    def enclosing(self, name):
+        """
+        (zone, value) for every live zone that encloses name (name itself
+        included), deepest first, from a single walk down the trie.
+        Expired zones met on the way are removed.
+        """
+        now = self.clock()
+        found = []
+        with self.lock:
+            node = self.root
+            if node.value is not None:
+                found.append(node)
+            for label in _labels(name):
+                children = node.children
+                node = children.get(label) if children else None
+                if node is None:
+                    break
+                if node.value is not None:
+                    found.append(node)
+            out = []
+            for node in reversed(found):
+                if node.expiry <= now:
+                    self._drop(node)
+                    continue
+                self._touch(node)
+                out.append((self._name(node), node.value))
+        return out
+
+    def items(self):
+        """(zone, value, remaining seconds) for every live zone, least recently used first."""
+        now = self.clock()
+        out = []
+        with self.lock:
+            node = self.lru.next
+            while node is not self.lru:
+                if node.expiry > now:
+                    out.append((self._name(node), node.value, node.expiry - now))
+                node = node.next
+        return out
@@ -1,72 +1,12 @@
-import re
 import sys
 import matplotlib.pyplot as plt
-import pandas as pd
 import numpy as np
+from log_parser import load_frames, step_heights
 
 def parse_log(filename):
-    results = []
-    domain = None
-    steps = 0
-    total_time = None
-    success = None
-    rtts = []
-    order_counter = 0
-
-    with open(filename, 'r', encoding='utf-8', errors='ignore') as f:
-        lines = f.readlines()
-
-    for raw in lines:
-        line = raw.strip()
-
-        if "Query from" in line and " for " in line:
-            if domain is not None:
-                results.append({
-                    "domain": domain,
-                    "steps": steps,
-                    "total_time": total_time,
-                    "success": success,
-                    "rtts": rtts,
-                    "order": order_counter
-                })
-                order_counter += 1
-
-            m = re.search(r'for\s+([^\s]+)', line)
-            domain = m.group(1).rstrip('.') if m else "UNKNOWN"
-            steps = 0
-            total_time = None
-            success = True
-            rtts = []
-
-        elif "RTT:" in line:
-            m = re.search(r"RTT:\s*([\d\.]+)\s*ms", line)
-            if m:
-                rtts.append(float(m.group(1)))
-                steps += 1
-
-
-        elif "Total resolution time:" in line:
-            m = re.search(r"Total resolution time:\s*([\d\.]+)\s*ms", line)
-            if m:
-                total_time = float(m.group(1))
-
-        elif "Resolution failed" in line:
-            success = False
-
-
-    if domain is not None:
-        results.append({
-            "domain": domain,
-            "steps": steps,
-            "total_time": total_time,
-            "success": success,
-            "rtts": rtts,
-            "order": order_counter
-        })
-
-    df = pd.DataFrame(results)
+    df, steps = load_frames(filename)
     df = df.dropna(subset=["total_time"]).reset_index(drop=True)
-    return df
+    return df, steps
 
 
 def consolidate_all(df):
@@ -75,18 +15,13 @@ def consolidate_all(df):
     - Keep the last successful entry if available.
     - Otherwise keep the latest entry (even if failed).
     """
-    latest = {}
-    for _, row in df.iterrows():
-        domain = row["domain"]
-        if domain not in latest:
-            latest[domain] = row.to_dict()
-        else:
-            if row["success"] or not latest[domain]["success"]:
-                latest[domain] = row.to_dict()
-    return pd.DataFrame(latest.values()).sort_values("order").reset_index(drop=True)
+    # success sorts after failure, so each domain's last row in this order
+    # is its latest success, or its latest entry if it never succeeded
+    latest = df.sort_values(["success", "order"]).groupby("domain", sort=False).tail(1)
+    return latest.sort_values("order").reset_index(drop=True)
 
 
-def plot_results(df_all):
+def plot_results(df_all, steps):
     if df_all.empty:
         print("No data to plot.")
         return
@@ -98,10 +33,11 @@ def plot_results(df_all):
     x = np.arange(len(df_all))
     bottoms = np.zeros(len(df_all))
 
+    heights = step_heights(steps, df_all["order"])
     for i in range(df_all["steps"].max()):
-        heights = [rtts[i] if len(rtts) > i else 0 for rtts in df_all["rtts"]]
-        plt.bar(x, heights, bottom=bottoms, label=f"Step {i+1}")
-        bottoms += np.array(heights)
+        column = heights[i].to_numpy() if i in heights else np.zeros(len(df_all))
+        plt.bar(x, column, bottom=bottoms, label=f"Step {i+1}")
+        bottoms += column
 
     plt.xticks(x, df_all["domain"], rotation=45, ha="right")
     plt.title("Resolution Latency Breakdown (all unique domains)")
@@ -128,11 +64,11 @@ if __name__ == "__main__":
         sys.exit(1)
 
     logfile = sys.argv[1]
-    df = parse_log(logfile)
+    df, steps = parse_log(logfile)
 
     if df.empty:
         print("No valid query data found in log.")
         sys.exit(0)
 
     df_all = consolidate_all(df)
-    plot_results(df_all)
+    plot_results(df_all, steps)
@@ -1,70 +1,12 @@
-import re
 import sys
 import matplotlib.pyplot as plt
-import pandas as pd
 import numpy as np
+from log_parser import load_frames, step_heights
 
 def parse_log(filename):
-    results = []
-    domain = None
-    steps = 0
-    total_time = None
-    success = None
-    rtts = []
-    order_counter = 0
-
-    with open(filename, 'r', encoding='utf-8', errors='ignore') as f:
-        lines = f.readlines()
-
-    for raw in lines:
-        line = raw.strip()
-
-        if "Query from" in line and " for " in line:
-            if domain is not None:
-                results.append({
-                    "domain": domain,
-                    "steps": steps,
-                    "total_time": total_time,
-                    "success": success,
-                    "rtts": rtts,
-                    "order": order_counter
-                })
-                order_counter += 1
-
-            m = re.search(r'for\s+([^\s]+)', line)
-            domain = m.group(1).rstrip('.') if m else "UNKNOWN"
-            steps = 0
-            total_time = None
-            success = True
-            rtts = []
-
-        elif "RTT:" in line:
-            m = re.search(r"RTT:\s*([\d\.]+)\s*ms", line)
-            if m:
-                rtts.append(float(m.group(1)))
-                steps += 1
-
-        elif "Total resolution time:" in line:
-            m = re.search(r"Total resolution time:\s*([\d\.]+)\s*ms", line)
-            if m:
-                total_time = float(m.group(1))
-
-        elif "Resolution failed" in line:
-            success = False
-
-    if domain is not None:
-        results.append({
-            "domain": domain,
-            "steps": steps,
-            "total_time": total_time,
-            "success": success,
-            "rtts": rtts,
-            "order": order_counter
-        })
-
-    df = pd.DataFrame(results)
+    df, steps = load_frames(filename)
     df = df.dropna(subset=["total_time"]).reset_index(drop=True)
-    return df
+    return df, steps
 
 
 def select_first_10(df):
@@ -72,28 +14,20 @@ def select_first_10(df):
     Keep the first 10 unique domains that appear in the log.
     If a later entry for one of these domains is successful, replace the earlier one.
     """
-    selected = {}
-    domain_order = []
+    first_seen = df.drop_duplicates(subset=["domain"])
+    domain_order = first_seen["domain"].head(10)
+    # once the 10th domain has shown up, later rows are not considered
+    window = df.loc[:first_seen.index[9]] if len(first_seen) >= 10 else df
+    window = window[window["domain"].isin(domain_order)]
 
-    for _, row in df.iterrows():
-        domain = row["domain"]
+    # first successful row per domain, falling back to its first row
+    ranked = window.assign(failed=~window["success"].astype(bool))
+    chosen = ranked.sort_values(["failed", "order"], kind="stable").groupby("domain").head(1)
+    chosen = chosen.set_index("domain").loc[domain_order].reset_index()
+    return chosen.drop(columns="failed")
 
-        if domain not in selected:
-            if len(selected) < 10:
-                selected[domain] = row.to_dict()
-                domain_order.append(domain)
-        else:
-            if not selected[domain]["success"] and row["success"]:
-                selected[domain] = row.to_dict()
 
-        if len(selected) == 10 and all(d in selected for d in domain_order):
-            break
-
-    ordered = [selected[d] for d in domain_order if d in selected]
-    return pd.DataFrame(ordered)
-
-
-def plot_results(df10):
+def plot_results(df10, steps):
     if df10.empty:
         print("No data to plot.")
         return
@@ -105,10 +39,11 @@ def plot_results(df10):
     x = np.arange(len(df10))
     bottoms = np.zeros(len(df10))
 
+    heights = step_heights(steps, df10["order"])
     for i in range(df10["steps"].max()):
-        heights = [rtts[i] if len(rtts) > i else 0 for rtts in df10["rtts"]]
-        plt.bar(x, heights, bottom=bottoms, label=f"Step {i+1}")
-        bottoms += np.array(heights)
+        column = heights[i].to_numpy() if i in heights else np.zeros(len(df10))
+        plt.bar(x, column, bottom=bottoms, label=f"Step {i+1}")
+        bottoms += column
 
     plt.xticks(x, df10["domain"], rotation=45, ha="right")
     plt.title("Resolution Latency Breakdown (first 10 unique domains)")
@@ -134,11 +69,11 @@ if __name__ == "__main__":
         sys.exit(1)
 
     logfile = sys.argv[1]
-    df = parse_log(logfile)
+    df, steps = parse_log(logfile)
 
     if df.empty:
         print("No valid query data found in log.")
         sys.exit(0)
 
     df10 = select_first_10(df)
-    plot_results(df10)
+    plot_results(df10, steps)
@@ -0,0 +1,255 @@
+import json
+import os
+import re
+import sys
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Custom_Resolver_Scripts"))
+import trace_format
+
+# One client query from a resolver log. rtts/stages/servers describe each
+# answered upstream step. offset/next_offset are byte positions of the
+# record in the file; resume from next_offset to pick up where this record
+# left off.
+QueryRecord = namedtuple(
+    "QueryRecord",
+    ["domain", "steps", "total_time", "success", "rtts", "stages", "servers",
+     "order", "offset", "next_offset"],
+)
+QUERY_COLUMNS = ["domain", "steps", "total_time", "success", "order"]
+
+DOMAIN_RE = re.compile(r'for\s+([^\s]+)')
+RTT_RE = re.compile(r"RTT:\s*([\d\.]+)\s*ms")
+STEP_RE = re.compile(r"Stage:\s*([^|]*?)\s*\|\s*Server:\s*([^|]*?)\s*\|")
+TOTAL_RE = re.compile(r"Total resolution time:\s*([\d\.]+)\s*ms")
+
+
+def _from_json(obj, order, offset, next_offset):
+    answered = [s for s in obj.get("steps", []) if s.get("rtt") is not None]
+    return QueryRecord(obj.get("qname", "UNKNOWN").rstrip('.'), len(answered), obj.get("total_ms"),
+                       bool(obj.get("success")), [s["rtt"] for s in answered],
+                       [s.get("stage") for s in answered], [s.get("server") for s in answered],
+                       order, offset, next_offset)
+
+
+def iter_queries(filename, offset=0, order=0, final=True):
+    """
+    Stream QueryRecords out of a resolver log, text or JSON-lines, one at a
+    time without loading the file. Parsing starts at byte `offset` with
+    record numbering from `order`.
+
+    With final=False the file is treated as still growing: the last block
+    (which may be half written) is held back, so resuming later from the
+    last yielded next_offset never loses or duplicates a query.
+    """
+    current = None
+    pos = offset
+    with open(filename, "rb") as f:
+        f.seek(offset)
+        for raw in f:
+            line_start = pos
+            if not raw.endswith(b"\n") and not final:
+                break  # a line the resolver is still writing
+            pos += len(raw)
+            line = raw.decode("utf-8", errors="ignore").strip()
+
+            if line.startswith("{"):
+                try:
+                    obj = json.loads(line)
+                except ValueError:
+                    continue
+                if "qname" not in obj:
+                    continue
+                if current is not None:
+                    yield QueryRecord(**current, next_offset=line_start)
+                    order += 1
+                    current = None
+                yield _from_json(obj, order, line_start, pos)
+                order += 1
+
+            elif "Query from" in line and " for " in line:
+                if current is not None:
+                    yield QueryRecord(**current, next_offset=line_start)
+                    order += 1
+                m = DOMAIN_RE.search(line)
+                current = {
+                    "domain": m.group(1).rstrip('.') if m else "UNKNOWN",
+                    "steps": 0,
+                    "total_time": None,
+                    "success": True,
+                    "rtts": [],
+                    "stages": [],
+                    "servers": [],
+                    "order": order,
+                    "offset": line_start,
+                }
+
+            elif current is None:
+                continue
+
+            elif "RTT:" in line:
+                m = RTT_RE.search(line)
+                if m:
+                    current["rtts"].append(float(m.group(1)))
+                    current["steps"] += 1
+                    step = STEP_RE.search(line)
+                    current["stages"].append(step.group(1) if step else None)
+                    current["servers"].append(step.group(2) if step else None)
+
+            elif "Total resolution time:" in line:
+                m = TOTAL_RE.search(line)
+                if m:
+                    current["total_time"] = float(m.group(1))
+
+            elif "Resolution failed" in line:
+                current["success"] = False
+
+    if current is not None and final:
+        yield QueryRecord(**current, next_offset=pos)
+
+
+def to_frames(records):
+    """
+    Split QueryRecords into two DataFrames:
+    - queries: one row per query (QUERY_COLUMNS), keyed by "order"
+    - steps: long/columnar layout, one row per answered upstream step with
+      columns order, step (0-based), stage, server, rtt
+    The step columns are accumulated as flat arrays, so nothing downstream
+    has to walk per-row Python lists.
+    """
+    rows = []
+    orders, step_idx, stages, servers, rtts = [], [], [], [], []
+    for rec in records:
+        rows.append((rec.domain, rec.steps, rec.total_time, rec.success, rec.order))
+        n = len(rec.rtts)
+        orders.extend([rec.order] * n)
+        step_idx.extend(range(n))
+        stages.extend(rec.stages)
+        servers.extend(rec.servers)
+        rtts.extend(rec.rtts)
+
+    queries = pd.DataFrame(rows, columns=QUERY_COLUMNS)
+    steps = pd.DataFrame({
+        "order": np.array(orders, dtype=np.int64),
+        "step": np.array(step_idx, dtype=np.int32),
+        "stage": pd.Categorical(stages),
+        "server": pd.Categorical(servers),
+        "rtt": np.array(rtts, dtype=np.float64),
+    })
+    return queries, steps
+
+
+def _categorical(codes, strings):
+    cat = pd.Categorical.from_codes(codes, categories=strings).remove_unused_categories()
+    return cat.reorder_categories(sorted(cat.categories))
+
+
+def load_trace(path):
+    """
+    The (queries, steps) frames of to_frames() for a binary trace directory
+    written with --log-format trace, or a directory of per-worker traces.
+    Columns are taken straight from the memory-mapped record arrays and
+    strings are decoded once per distinct value, not once per row.
+    """
+    parts = []
+    for trace in trace_format.trace_dirs(path):
+        q, s, strings = trace_format.open_trace(trace)
+        s = s[(s["query"] < len(q)) & ~np.isnan(s["rtt"])]  # answered steps only
+        names = np.array([name.rstrip('.') for name in strings], dtype=object)
+        queries = pd.DataFrame({
+            "time": np.array(strings, dtype=object)[q["time"]] if len(q) else np.array([], dtype=object),
+            "domain": names[q["qname"]] if len(q) else np.array([], dtype=object),
+            "steps": np.bincount(s["query"], minlength=len(q)).astype(np.int64),
+            "total_time": np.where(np.isnan(q["total_ms"]), np.nan, q["total_ms"].astype(np.float64).round(2)),
+            "success": q["success"].astype(bool),
+        })
+        steps = pd.DataFrame({
+            "local": s["query"].astype(np.int64),
+            "stage": _categorical(s["stage"], strings),
+            "server": _categorical(s["server"], strings),
+            "rtt": s["rtt"].astype(np.float64).round(2),
+        })
+        parts.append((queries, steps))
+
+    if not parts:
+        return to_frames([])
+    # number queries in time order across workers; one worker keeps its own
+    offsets = np.cumsum([0] + [len(q) for q, _ in parts])
+    queries = pd.concat([q for q, _ in parts], ignore_index=True)
+    if len(parts) > 1:
+        position = queries["time"].argsort(kind="stable").to_numpy()
+    else:
+        position = np.arange(len(queries))
+    order = np.empty(len(queries), dtype=np.int64)
+    order[position] = np.arange(len(queries))
+    queries["order"] = order
+    queries = queries.iloc[position].reset_index(drop=True)[QUERY_COLUMNS]
+
+    step_order = np.concatenate([order[off + st["local"].to_numpy()] for off, (_, st) in zip(offsets, parts)])
+    steps = pd.DataFrame({
+        "order": step_order,
+        "stage": pd.api.types.union_categoricals([st["stage"] for _, st in parts], sort_categories=True),
+        "server": pd.api.types.union_categoricals([st["server"] for _, st in parts], sort_categories=True),
+        "rtt": np.concatenate([st["rtt"].to_numpy() for _, st in parts]),
+    })
+    steps = steps.sort_values("order", kind="stable").reset_index(drop=True)
+    steps.insert(1, "step", steps.groupby("order").cumcount().astype(np.int32))
+    return queries, steps
+
+
+def load_frames(path):
+    """(queries, steps) frames for a resolver log file or a binary trace directory."""
+    if os.path.isdir(path):
+        return load_trace(path)
+    return to_frames(iter_queries(path))
+
+
+def step_heights(steps, orders):
+    """
+    Stacked-bar matrix for the given queries: rows follow `orders`, one
+    column per step index, holding that step's RTT (0 where absent).
+    """
+    wanted = steps[steps["order"].isin(orders)]
+    heights = wanted.pivot_table(index="order", columns="step", values="rtt",
+                                 aggfunc="sum", fill_value=0)
+    return heights.reindex(list(orders), fill_value=0)
+
+
+def load_offset(state_file):
+    """Return the (offset, order) saved by save_offset, or (0, 0)."""
+    try:
+        with open(state_file) as f:
+            offset, order = f.read().split()
+            return int(offset), int(order)
+    except (OSError, ValueError):
+        return 0, 0
+
+
+def save_offset(state_file, offset, order):
+    tmp = state_file + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(f"{offset} {order}\n")
+    os.replace(tmp, state_file)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python log_parser.py <resolver_log.txt> [state_file]")
+        sys.exit(1)
+
+    # Incremental mode: only report queries appended since the last run.
+    logfile = sys.argv[1]
+    state_file = sys.argv[2] if len(sys.argv) > 2 else logfile + ".offset"
+    offset, order = load_offset(state_file)
+    count = failures = 0
+    total = 0.0
+    for rec in iter_queries(logfile, offset, order, final=False):
+        count += 1
+        failures += not rec.success
+        total += rec.total_time or 0
+        offset, order = rec.next_offset, rec.order + 1
+    save_offset(state_file, offset, order)
+    avg = total / count if count else 0
+    print(f"New queries: {count}  failed: {failures}  avg total time: {avg:.2f} ms  (offset {offset})")
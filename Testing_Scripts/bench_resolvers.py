@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Benchmark the resolvers offline against the local fake hierarchy
+(fake_hierarchy.py) with a replay of the Extarcted_Queries workloads.
+
+For every resolver script it reports latency percentiles, upstream queries
+per client query and resolver CPU time per query, and saves the run as JSON
+under bench_results/ so two versions can be compared:
+
+  python bench_resolvers.py --label before
+  python bench_resolvers.py --label after
+  python bench_resolvers.py --compare bench_results/before.json bench_results/after.json
+
+With --profile DIR every resolver run is also profiled (see the resolver's
+--profile option); inspect with python -m pstats DIR/dns_resolver-x1.prof.
+"""
+import argparse
+import glob
+import json
+import os
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_hierarchy import ROOT_IP, add_hierarchy_args, hierarchy_from_args
+from replay_queries import load_queries, percentile, run, RCODES
+from dns_wire import build_query
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+RESOLVER_DIR = os.path.join(REPO, "Custom_Resolver_Scripts")
+DEFAULT_SCRIPTS = ["dns_resolver.py", "dns_resolver_loop.py"]
+RESULTS_DIR = os.path.join(HERE, "bench_results")
+RESOLVER_IP = "127.53.200.1"
+CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+# (key, label, format, lower is better)
+METRICS = [
+    ("p50_ms", "p50 (ms)", "{:.2f}", True),
+    ("p95_ms", "p95 (ms)", "{:.2f}", True),
+    ("p99_ms", "p99 (ms)", "{:.2f}", True),
+    ("qps", "Answered qps", "{:.1f}", False),
+    ("timeouts", "Timeouts", "{:d}", True),
+    ("upstream_per_query", "Upstream/query", "{:.2f}", True),
+    ("cpu_ms_per_query", "CPU ms/query", "{:.3f}", True),
+]
+
+
+def _proc_stat(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        return f.read().rsplit(")", 1)[1].split()
+
+
+def cpu_seconds(pid):
+    """utime + stime of a process and its live children (pre-forked workers), from /proc (Linux only)."""
+    try:
+        fields = _proc_stat(pid)
+    except (OSError, IndexError):
+        return None
+    total = int(fields[11]) + int(fields[12])
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            child = _proc_stat(entry)
+        except (OSError, IndexError):
+            continue
+        if child[1] == str(pid):
+            total += int(child[11]) + int(child[12])
+    return total / CLK_TCK
+
+
+def wait_ready(addr, proc, timeout=10.0):
+    """Wait until the resolver answers (or drops) a probe without the process dying."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(0.5)
+    deadline = time.monotonic() + timeout
+    try:
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                return False
+            try:
+                sock.sendto(build_query("ns0.fakedns.net."), addr)
+                sock.recvfrom(4096)
+                return True
+            except OSError:
+                time.sleep(0.1)
+        return False
+    finally:
+        sock.close()
+
+
+def bench_script(script, queries, hierarchy, args, port, processes=1):
+    with tempfile.TemporaryDirectory() as tmp:
+        log_file = os.path.join(tmp, "resolver_log.txt")
+        cmd = [sys.executable, os.path.join(RESOLVER_DIR, script), log_file,
+               "--bind", RESOLVER_IP, "--port", str(port),
+               "--root-servers", ROOT_IP, "--upstream-port", str(args.upstream_port),
+               "--no-echo", "--brief-log", "--processes", str(processes)] + shlex.split(args.resolver_args)
+        if args.profile:
+            os.makedirs(args.profile, exist_ok=True)
+            name = f"{os.path.splitext(script)[0]}-x{processes}.{'folded' if args.profile_mode == 'sample' else 'prof'}"
+            cmd += ["--profile", os.path.join(args.profile, name), "--profile-mode", args.profile_mode]
+        stderr = open(os.path.join(tmp, "stderr.txt"), "w+")
+        proc = subprocess.Popen(cmd, cwd=RESOLVER_DIR, stdout=subprocess.DEVNULL, stderr=stderr)
+        try:
+            if not wait_ready((RESOLVER_IP, port), proc):
+                stderr.seek(0)
+                raise RuntimeError(f"{script} did not come up: {' '.join(cmd)}\n{stderr.read()}")
+            upstream_before = hierarchy.total_queries()
+            cpu_before = cpu_seconds(proc.pid)
+            replayer, duration = run(queries, argparse.Namespace(**{**vars(args), "port": port}))
+            cpu_after = cpu_seconds(proc.pid)
+            upstream_queries = hierarchy.total_queries() - upstream_before
+        finally:
+            proc.send_signal(signal.SIGINT)
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+            stderr.close()
+
+    lat = sorted(replayer.latencies)
+    sent = replayer.sent or 1
+    cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+    return {
+        "sent": replayer.sent,
+        "answered": len(lat),
+        "timeouts": replayer.timeouts,
+        "rcodes": {RCODES.get(k, str(k)): v for k, v in sorted(replayer.rcodes.items())},
+        "duration_s": round(duration, 3),
+        "qps": len(lat) / duration if duration else 0.0,
+        "p50_ms": percentile(lat, 50),
+        "p95_ms": percentile(lat, 95),
+        "p99_ms": percentile(lat, 99),
+        "mean_ms": sum(lat) / len(lat) if lat else 0.0,
+        "upstream_queries": upstream_queries,
+        "upstream_per_query": upstream_queries / sent,
+        "cpu_ms_per_query": cpu * 1000 / sent if cpu is not None else None,
+    }
+
+
+def print_results(results):
+    names = list(results)
+    width = max(len(n) for n in names) + 2
+    print("\n" + "Metric".ljust(16) + "".join(n.rjust(width) for n in names))
+    for key, label, fmt, _ in METRICS:
+        cells = []
+        for name in names:
+            value = results[name].get(key)
+            cells.append(("-" if value is None else fmt.format(value)).rjust(width))
+        print(label.ljust(16) + "".join(cells))
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"Comparing {old.get('label')} ({old.get('commit', '?')[:10]}) -> "
+          f"{new.get('label')} ({new.get('commit', '?')[:10]})")
+    if old.get("config") != new.get("config"):
+        print("  note: the two runs used different settings")
+    for script in new["results"]:
+        if script not in old["results"]:
+            continue
+        a, b = old["results"][script], new["results"][script]
+        print(f"\n{script}")
+        for key, label, fmt, lower_better in METRICS:
+            if a.get(key) is None or b.get(key) is None:
+                continue
+            change = (b[key] - a[key]) / a[key] * 100 if a[key] else 0.0
+            worse = change > 5 if lower_better else change < -5
+            print(f"  {label:<16}{fmt.format(a[key]):>12}{fmt.format(b[key]):>12}{change:>+9.1f}%"
+                  + ("  REGRESSION" if worse else ""))
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO, capture_output=True,
+                              text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the resolvers against a local fake DNS hierarchy")
+    parser.add_argument("queries_csv", nargs="*",
+                        help="workload CSVs (default: all Extarcted_Queries/H*_queries.csv)")
+    parser.add_argument("--scripts", nargs="+", default=DEFAULT_SCRIPTS, help="resolver scripts to run")
+    parser.add_argument("--resolver-args", default="", help="extra resolver options, e.g. \"--workers 16\"")
+    parser.add_argument("--port", type=int, default=5353, help="port the resolver under test listens on")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1], metavar="N",
+                        help="run each script with these --processes counts, e.g. 1 2 4, to see QPS scaling")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--concurrency", type=int, help="closed loop with N outstanding queries")
+    mode.add_argument("--qps", type=float, help="open loop at a fixed query rate")
+    mode.add_argument("--timed", action="store_true", help="replay with the capture timestamps")
+    parser.add_argument("--speedup", type=float, default=1.0, help="time scale for --timed")
+    parser.add_argument("--timeout", type=float, default=5.0, help="seconds before a query counts as lost")
+    parser.add_argument("--limit", type=int, help="only replay the first N queries")
+    parser.add_argument("--label", default=time.strftime("%Y%m%d-%H%M%S"), help="name of the saved run")
+    parser.add_argument("--results-dir", default=RESULTS_DIR)
+    parser.add_argument("--profile", metavar="DIR",
+                        help="profile each resolver run, writing its profile and per-query split into DIR")
+    parser.add_argument("--profile-mode", choices=["cprofile", "sample"], default="cprofile")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="diff two saved runs and exit")
+    add_hierarchy_args(parser)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if not (args.concurrency or args.qps or args.timed):
+        args.concurrency = 1
+
+    paths = args.queries_csv or sorted(glob.glob(os.path.join(REPO, "Extarcted_Queries", "H*_queries.csv")))
+    queries = [q for path in paths for q in load_queries(path)][:args.limit]
+    if not queries:
+        print("No queries found.")
+        sys.exit(1)
+
+    hierarchy = hierarchy_from_args([d for _, d in queries], args).start()
+    args.server = RESOLVER_IP
+    print(f"Fake hierarchy: {len(hierarchy.zones)} zones, {len(hierarchy.tld_ips)} TLDs; "
+          f"replaying {len(queries)} queries from {len(paths)} file(s)")
+
+    results = {}
+    runs = [(script, n) for script in args.scripts for n in args.processes]
+    try:
+        for i, (script, n) in enumerate(runs):
+            name = script if args.processes == [1] else f"{script} x{n}"
+            print(f"  running {name} ...")
+            # fresh port per run, so late replies to the previous one are not counted
+            results[name] = bench_script(script, queries, hierarchy, args, args.port + i, n)
+    finally:
+        hierarchy.stop()
+    print_results(results)
+    if len(args.processes) > 1:
+        print("\nQPS scaling with --processes (relative to the first count):")
+        for script in args.scripts:
+            base = results[f"{script} x{args.processes[0]}"]["qps"] or 1
+            print(f"  {script}: " + ", ".join(
+                f"x{n} {results[f'{script} x{n}']['qps'] / base:.2f}" for n in args.processes))
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    out = os.path.join(args.results_dir, f"{args.label}.json")
+    config = {k: v for k, v in vars(args).items()
+              if k not in ("label", "results_dir", "compare", "server", "profile", "profile_mode")}
+    config["queries_csv"] = [os.path.relpath(p, REPO) for p in paths]
+    with open(out, "w") as f:
+        json.dump({"label": args.label, "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                   "commit": git_commit(), "config": config, "results": results}, f, indent=2)
+    print(f"\nSaved results to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: full dnslib parsing + per-RR log strings (the old resolve
+loop) against dns_wire's lean parsing, on responses rebuilt from the
+recorded Part D resolver logs.
+"""
+import glob
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Custom_Resolver_Scripts"))
+
+from dnslib import DNSRecord, RR, QTYPE
+import dns_wire
+
+STEP_RE = re.compile(r"Stage:\s*(\w+)")
+RR_RE = re.compile(r"^\s+(\S+) -> (\d+) -> (.+)$")
+
+
+def recorded_responses(log_files):
+    """Rebuild one wire-format response per logged upstream step."""
+    responses = []
+    domain = stage = None
+    records = []
+
+    def flush():
+        if domain and records and stage in ("Root", "TLD", "Authoritative"):
+            msg = DNSRecord.question(domain).reply()
+            for rr in records:
+                if rr.rtype in (1, 5) and stage == "Authoritative":
+                    msg.add_answer(rr)
+                else:
+                    msg.add_auth(rr)
+            responses.append(bytes(msg.pack()))
+
+    for path in log_files:
+        with open(path, encoding="utf-8", errors="ignore") as f:
+            for line in f:
+                if "Query from" in line and " for " in line:
+                    flush()
+                    records = []
+                    domain = line.rsplit(" for ", 1)[1].strip()
+                elif "| Stage:" in line:
+                    flush()
+                    records = []
+                    m = STEP_RE.search(line)
+                    stage = m.group(1) if m else None
+                else:
+                    m = RR_RE.match(line)
+                    if m:
+                        name, rtype, rdata = m.groups()
+                        try:
+                            records.append(RR.fromZone(f"{name} 300 IN {QTYPE[int(rtype)]} {rdata}")[0])
+                        except Exception:
+                            pass
+        flush()
+    return responses
+
+
+def old_path(data):
+    resp = DNSRecord.parse(data)
+    summary = [f"{rr.rname} -> {rr.rtype} -> {rr.rdata}" for rr in (resp.rr or resp.auth or [])]
+    glue = [str(rr.rdata) for rr in resp.ar if rr.rtype == 1]
+    ns_names = [str(rr.rdata) for rr in resp.auth if rr.rtype == 2]
+    return bool(resp.rr), summary, glue, ns_names
+
+
+def lean_path(data):
+    resp = dns_wire.parse_response(data)
+    glue = [rr.rdata for rr in resp.ar if rr.rtype == 1]
+    ns_names = [rr.rdata for rr in resp.auth if rr.rtype == 2]
+    return bool(resp.rr), glue, ns_names
+
+
+def bench(fn, responses, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for data in responses:
+            fn(data)
+    return (time.perf_counter() - t0) / (repeat * len(responses)) * 1e6
+
+
+if __name__ == "__main__":
+    here = os.path.dirname(os.path.abspath(__file__))
+    logs = sys.argv[1:] or sorted(glob.glob(os.path.join(here, "..", "Logs_PartD", "*.txt")))
+    responses = recorded_responses(logs)
+    if not responses:
+        print("No responses could be rebuilt from the logs.")
+        sys.exit(1)
+
+    for data in responses:
+        old_answer, _, old_glue, old_ns = old_path(data)
+        assert lean_path(data) == (old_answer, old_glue, old_ns)
+
+    repeat = max(1, 20000 // len(responses))
+    old_us = bench(old_path, responses, repeat)
+    lean_us = bench(lean_path, responses, repeat)
+    print(f"Responses rebuilt from logs: {len(responses)}")
+    print(f"dnslib parse + RR strings : {old_us:8.2f} us/response")
+    print(f"dns_wire lean parse       : {lean_us:8.2f} us/response")
+    print(f"Speed-up                  : {old_us / lean_us:8.2f}x")
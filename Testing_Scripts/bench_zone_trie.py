@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Memory and lookup benchmark of the delegation index: the ZoneTrie the
+cache now uses against the flat OrderedDict of ("ns", zone) keys it
+replaced, filled with N synthetic zone cuts (default 1,000,000).
+
+  python bench_zone_trie.py            # 1M zones
+  python bench_zone_trie.py -n 100000
+"""
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Custom_Resolver_Scripts"))
+
+from resolver_cache import zone_chain
+from zone_trie import ZoneTrie
+
+TLDS = ["com", "org", "net", "ru", "de", "uk", "info", "it", "nl", "fr", "jp", "br", "pl", "in", "cn"]
+
+
+def synthetic_zones(n, seed=1):
+    """n distinct zone names, mostly second-level with some deeper cuts (co.uk style)."""
+    rng = random.Random(seed)
+    zones = []
+    for i in range(n):
+        tld = rng.choice(TLDS)
+        if rng.random() < 0.15:
+            zones.append(f"site{i}.{rng.choice(['co', 'ac', 'gov', 'org'])}.{tld}.")
+        else:
+            zones.append(f"domain{i}.{tld}.")
+    return zones
+
+
+def flat_closest(entries, qname, now):
+    """The old lookup: one dict probe per enclosing name."""
+    for zone in zone_chain(qname):
+        entry = entries.get(("ns", zone))
+        if entry and entry[0] > now:
+            return zone, entry[1]
+    return None, None
+
+
+def build(kind, zones, ns):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    if kind == "trie":
+        index = ZoneTrie(max_entries=len(zones) + 1)
+        for zone in zones:
+            index.put(zone, ns, 86400)
+    else:
+        index = OrderedDict()
+        for zone in zones:
+            index[("ns", zone.lower())] = (time.monotonic() + 86400, ns)
+    elapsed = time.perf_counter() - started
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return index, size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ZoneTrie delegation index")
+    parser.add_argument("-n", type=int, default=1_000_000, help="zone cuts to store")
+    parser.add_argument("--lookups", type=int, default=200_000)
+    args = parser.parse_args()
+
+    zones = synthetic_zones(args.n)
+    ns = ["ns1.provider.net.", "ns2.provider.net."]  # shared, so only the index is measured
+    rng = random.Random(2)
+    qnames = [f"www.{rng.choice(zones)}" for _ in range(args.lookups // 2)]
+    qnames += [f"www.missing{i}.{rng.choice(TLDS)}." for i in range(args.lookups - len(qnames))]
+    rng.shuffle(qnames)
+
+    print(f"{args.n} zones, {len(qnames)} closest-enclosure lookups (half hits)\n")
+    print(f"{'Index':<14}{'Memory MB':>11}{'B/zone':>9}{'Build s':>9}{'Lookup us':>11}")
+    for kind in ("flat dict", "trie"):
+        index, size, build_s = build("trie" if kind == "trie" else "flat", zones, ns)
+        now = time.monotonic()
+        started = time.perf_counter()
+        if kind == "trie":
+            for q in qnames:
+                index.enclosing(q)
+        else:
+            for q in qnames:
+                flat_closest(index, q, now)
+        lookup_us = (time.perf_counter() - started) / len(qnames) * 1e6
+        print(f"{kind:<14}{size / 2**20:>11.1f}{size / args.n:>9.0f}{build_s:>9.2f}{lookup_us:>11.2f}")
+        del index
+        gc.collect()
+
+
+if __name__ == "__main__":
+    main()
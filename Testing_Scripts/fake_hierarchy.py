@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the DNS hierarchy the resolvers walk: one root server,
+one server per TLD and a few authoritative servers, all on 127.53.x.y
+loopback addresses, serving zones made up for the workload's domains.
+Lets the resolvers be measured offline and reproducibly.
+"""
+import argparse
+import heapq
+import itertools
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+import zlib
+
+from dnslib import DNSRecord, RR, QTYPE, RCODE, A, NS, CNAME, SOA, EDNS0
+
+ROOT_IP = "127.53.0.1"
+PROVIDER_ZONE = "fakedns.net."
+LARGE_RECORDS = 100  # A records in a "large" answer, ~1.7 KB: needs TCP
+
+
+def _unit(text, salt):
+    """Deterministic value in [0, 1) for a name, so runs are repeatable."""
+    return (zlib.crc32(f"{salt}:{text}".encode()) & 0xFFFFFFFF) / 2**32
+
+
+def _zone_of(name):
+    labels = name.rstrip(".").lower().split(".")
+    return ".".join(labels[-2:]) + "."
+
+
+def _tld_of(name):
+    return name.rstrip(".").lower().split(".")[-1] + "."
+
+
+class FakeHierarchy:
+    """
+    Root -> TLD -> authoritative servers for every second-level zone in
+    `domains`. Zone behaviour is derived from a hash of its name:
+    - nxdomain: fraction of zones that do not exist (TLD answers NXDOMAIN)
+    - glueless: fraction of delegations whose NS lives in fakedns.net and
+      comes without glue
+    - cname: fraction of zones answering through a CNAME chain of
+      cname_len in-zone links
+    - large: fraction of zones whose answers hold LARGE_RECORDS addresses
+    delays are per role ("root", "tld", "auth") in ms, with +-jitter, and
+    loss drops that share of UDP queries silently. Every server also
+    listens on TCP; UDP answers larger than the query's EDNS buffer (or
+    512 bytes) come back truncated.
+    """
+
+    def __init__(self, domains, port=5300, delays=None, jitter=0.2, loss=0.0,
+                 glueless=0.2, cname=0.1, cname_len=2, nxdomain=0.0, large=0.0,
+                 auth_servers=8, seed=1):
+        self.port = port
+        self.delays = {"root": 0.0, "tld": 0.0, "auth": 0.0}
+        self.delays.update(delays or {})
+        self.jitter = jitter
+        self.loss = loss
+        self.glueless = glueless
+        self.cname = cname
+        self.cname_len = cname_len
+        self.nxdomain = nxdomain
+        self.large = large
+        self.rng = random.Random(seed)
+        self.counts = {"root": 0, "tld": 0, "auth": 0}
+        self.tcp_queries = 0
+        self.count_lock = threading.Lock()
+
+        self.zones = {_zone_of(d) for d in domains if d.strip(".")}
+        tlds = sorted({_tld_of(z) for z in self.zones} | {_tld_of(PROVIDER_ZONE)})
+        self.tld_ips = {tld: f"127.53.{1 + i // 250}.{1 + i % 250}" for i, tld in enumerate(tlds)}
+        self.auth_ips = [f"127.53.100.{k + 1}" for k in range(auth_servers)]
+
+        self.sockets = []
+        self.outbox = []
+        self.outbox_cv = threading.Condition()
+        self.outbox_seq = itertools.count()
+        self.running = False
+
+    # --- zone data -------------------------------------------------------
+
+    def auth_index(self, zone):
+        return zlib.crc32(zone.encode()) % len(self.auth_ips)
+
+    def zone_exists(self, zone):
+        return zone in self.zones and _unit(zone, "nx") >= self.nxdomain
+
+    def _soa(self, zone, minimum=300):
+        suffix = zone if zone != "." else "root-servers.fake."
+        return RR(zone, QTYPE.SOA, ttl=minimum,
+                  rdata=SOA(f"ns.{suffix}", f"hostmaster.{suffix}", (1, 3600, 600, 86400, minimum)))
+
+    def _nxdomain(self, reply, zone):
+        reply.header.rcode = RCODE.NXDOMAIN
+        reply.add_auth(self._soa(zone))
+        return reply
+
+    def answer_root(self, query):
+        reply = query.reply()
+        reply.header.aa = 0
+        tld = _tld_of(str(query.q.qname))
+        if tld not in self.tld_ips:
+            return self._nxdomain(reply, ".")
+        ns = f"ns.{tld.rstrip('.')}-servers.fake."
+        reply.add_auth(RR(tld, QTYPE.NS, rdata=NS(ns), ttl=172800))
+        reply.add_ar(RR(ns, QTYPE.A, rdata=A(self.tld_ips[tld]), ttl=172800))
+        return reply
+
+    def answer_tld(self, query):
+        reply = query.reply()
+        reply.header.aa = 0
+        qname = str(query.q.qname)
+        zone = _zone_of(qname)
+        if zone == PROVIDER_ZONE:
+            ns = f"ns0.{PROVIDER_ZONE}"
+            reply.add_auth(RR(zone, QTYPE.NS, rdata=NS(ns), ttl=86400))
+            reply.add_ar(RR(ns, QTYPE.A, rdata=A(self.auth_ips[0]), ttl=86400))
+            return reply
+        if not self.zone_exists(zone):
+            return self._nxdomain(reply, _tld_of(qname))
+        k = self.auth_index(zone)
+        if _unit(zone, "glueless") < self.glueless:
+            reply.add_auth(RR(zone, QTYPE.NS, rdata=NS(f"ns{k}.{PROVIDER_ZONE}"), ttl=86400))
+        else:
+            ns = f"ns{k}.{zone}"
+            reply.add_auth(RR(zone, QTYPE.NS, rdata=NS(ns), ttl=86400))
+            reply.add_ar(RR(ns, QTYPE.A, rdata=A(self.auth_ips[k]), ttl=86400))
+        return reply
+
+    def answer_auth(self, query):
+        reply = query.reply()
+        qname = str(query.q.qname).lower()
+        zone = _zone_of(qname)
+        if zone == PROVIDER_ZONE:
+            label = qname.split(".")[0]
+            if label.startswith("ns") and label[2:].isdigit() and int(label[2:]) < len(self.auth_ips):
+                reply.add_answer(RR(qname, QTYPE.A, rdata=A(self.auth_ips[int(label[2:])]), ttl=86400))
+                return reply
+            return self._nxdomain(reply, zone)
+        if not self.zone_exists(zone):
+            return self._nxdomain(reply, zone)
+        if query.q.qtype != QTYPE.A:
+            reply.add_auth(self._soa(zone))
+            return reply
+
+        name = qname
+        if _unit(zone, "cname") < self.cname:
+            for i in range(self.cname_len):
+                target = f"c{i}.{zone}"
+                reply.add_answer(RR(name, QTYPE.CNAME, rdata=CNAME(target), ttl=300))
+                name = target
+        h = zlib.crc32(qname.encode())
+        count = LARGE_RECORDS if _unit(zone, "large") < self.large else 1
+        for i in range(count):
+            reply.add_answer(RR(name, QTYPE.A, rdata=A(f"10.{h >> 16 & 255}.{h >> 8 & 255 ^ i}.{h & 255 or 1}"),
+                                ttl=300))
+        return reply
+
+    # --- serving ---------------------------------------------------------
+
+    def start(self):
+        self.running = True
+        servers = [(ROOT_IP, "root", self.answer_root)]
+        servers += [(ip, "tld", self.answer_tld) for ip in self.tld_ips.values()]
+        servers += [(ip, "auth", self.answer_auth) for ip in self.auth_ips]
+        for ip, role, handler in servers:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((ip, self.port))
+            sock.settimeout(0.2)
+            self.sockets.append(sock)
+            threading.Thread(target=self._serve, args=(sock, role, handler), daemon=True).start()
+            tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            tcp.bind((ip, self.port))
+            tcp.listen(16)
+            tcp.settimeout(0.2)
+            self.sockets.append(tcp)
+            threading.Thread(target=self._serve_tcp, args=(tcp, role, handler), daemon=True).start()
+        threading.Thread(target=self._send_loop, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.running = False
+        with self.outbox_cv:
+            self.outbox_cv.notify()
+        for sock in self.sockets:
+            sock.close()
+
+    def total_queries(self):
+        with self.count_lock:
+            return sum(self.counts.values())
+
+    def _serve(self, sock, role, handler):
+        while self.running:
+            try:
+                data, addr = sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            with self.count_lock:
+                self.counts[role] += 1
+            if self.loss and self.rng.random() < self.loss:
+                continue
+            try:
+                reply = self._respond(data, handler, udp=True)
+            except Exception:
+                continue
+            with self.outbox_cv:
+                heapq.heappush(self.outbox, (time.monotonic() + self._delay(role), next(self.outbox_seq),
+                                             sock, reply, addr))
+                self.outbox_cv.notify()
+
+    def _delay(self, role):
+        return max(self.delays[role] * (1 + self.jitter * (2 * self.rng.random() - 1)) / 1000, 0)
+
+    def _respond(self, data, handler, udp):
+        query = DNSRecord.parse(data)
+        reply = handler(query)
+        opt = next((rr for rr in query.ar if rr.rtype == QTYPE.OPT), None)
+        if opt is not None:
+            reply.add_ar(EDNS0(udp_len=4096))
+        packed = reply.pack()
+        if udp and len(packed) > max(opt.rclass if opt else 512, 512):
+            reply.rr, reply.auth, reply.ar = [], [], []
+            reply.header.tc = 1
+            packed = reply.pack()
+        return bytes(packed)
+
+    def _serve_tcp(self, sock, role, handler):
+        while self.running:
+            try:
+                conn, _ = sock.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            threading.Thread(target=self._tcp_client, args=(conn, role, handler), daemon=True).start()
+
+    def _tcp_client(self, conn, role, handler):
+        with conn:
+            conn.settimeout(5)
+            try:
+                while self.running:
+                    header = conn.recv(2)
+                    if len(header) < 2:
+                        break
+                    length = struct.unpack("!H", header)[0]
+                    data = b""
+                    while len(data) < length:
+                        chunk = conn.recv(length - len(data))
+                        if not chunk:
+                            return
+                        data += chunk
+                    with self.count_lock:
+                        self.counts[role] += 1
+                        self.tcp_queries += 1
+                    time.sleep(self._delay(role))
+                    reply = self._respond(data, handler, udp=False)
+                    conn.sendall(struct.pack("!H", len(reply)) + reply)
+            except Exception:
+                pass
+
+    def _send_loop(self):
+        while self.running:
+            with self.outbox_cv:
+                while self.running and (not self.outbox or self.outbox[0][0] > time.monotonic()):
+                    wait = self.outbox[0][0] - time.monotonic() if self.outbox else None
+                    self.outbox_cv.wait(wait)
+                if not self.running:
+                    break
+                _, _, sock, reply, addr = heapq.heappop(self.outbox)
+            try:
+                sock.sendto(reply, addr)
+            except OSError:
+                pass
+
+
+def add_hierarchy_args(parser):
+    parser.add_argument("--upstream-port", type=int, default=5300, help="port the fake servers listen on")
+    parser.add_argument("--delay-root", type=float, default=20.0, help="root server delay (ms)")
+    parser.add_argument("--delay-tld", type=float, default=20.0, help="TLD server delay (ms)")
+    parser.add_argument("--delay-auth", type=float, default=40.0, help="authoritative server delay (ms)")
+    parser.add_argument("--jitter", type=float, default=0.2, help="relative delay jitter")
+    parser.add_argument("--loss", type=float, default=0.0, help="share of queries silently dropped")
+    parser.add_argument("--glueless", type=float, default=0.2, help="share of glueless delegations")
+    parser.add_argument("--cname", type=float, default=0.1, help="share of zones answering via CNAME chains")
+    parser.add_argument("--cname-len", type=int, default=2, help="CNAME links per chain")
+    parser.add_argument("--nxdomain", type=float, default=0.3, help="share of zones that do not exist")
+    parser.add_argument("--large", type=float, default=0.0, help="share of zones with answers too big for UDP")
+    parser.add_argument("--seed", type=int, default=1)
+
+
+def hierarchy_from_args(domains, args):
+    return FakeHierarchy(
+        domains, port=args.upstream_port,
+        delays={"root": args.delay_root, "tld": args.delay_tld, "auth": args.delay_auth},
+        jitter=args.jitter, loss=args.loss, glueless=args.glueless, cname=args.cname,
+        cname_len=args.cname_len, nxdomain=args.nxdomain, large=args.large, seed=args.seed)
+
+
+if __name__ == "__main__":
+    from replay_queries import load_queries
+
+    parser = argparse.ArgumentParser(description="Serve a fake root/TLD/authoritative hierarchy on loopback")
+    parser.add_argument("queries_csv", nargs="+", help="workload CSVs whose domains get zones")
+    add_hierarchy_args(parser)
+    args = parser.parse_args()
+
+    domains = [d for path in args.queries_csv for _, d in load_queries(path)]
+    hierarchy = hierarchy_from_args(domains, args).start()
+    print(f"Fake hierarchy: {len(hierarchy.zones)} zones, {len(hierarchy.tld_ips)} TLDs, "
+          f"root {ROOT_IP}:{args.upstream_port}")
+    print(f"Run a resolver with: --root-servers {ROOT_IP} --upstream-port {args.upstream_port}")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"  upstream queries so far: {hierarchy.counts}")
+    except KeyboardInterrupt:
+        hierarchy.stop()
+        sys.exit(0)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Replay an Extarcted_Queries CSV against a resolver with raw DNS/UDP queries.
+
+Modes:
+  --concurrency N   closed loop, N queries outstanding at any time
+  --qps R           open loop, a new query every 1/R seconds regardless of replies
+  --timed           original capture timing from column 0 (scaled by --speedup)
+"""
+import argparse
+import csv
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Custom_Resolver_Scripts"))
+
+import dns_wire
+
+RCODES = {0: "NOERROR", 2: "SERVFAIL", 3: "NXDOMAIN", 5: "REFUSED"}
+
+
+def load_queries(queries_csv):
+    """(capture timestamp, domain) for every row with a query name."""
+    queries = []
+    with open(queries_csv, newline='', encoding='utf-8-sig') as f:
+        for row in csv.reader(f):
+            if row and len(row) > 1 and row[1]:
+                try:
+                    ts = float(row[0])
+                except ValueError:
+                    ts = None
+                queries.append((ts, row[1]))
+    return queries
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[k]
+
+
+class Replayer:
+    """
+    Sends queries on one UDP socket and matches replies by query ID on a
+    receiver thread; a reaper expires queries older than `timeout`.
+    on_done() is called once per query, answered or timed out.
+    """
+
+    def __init__(self, server, timeout, on_done=None):
+        self.server = server
+        self.timeout = timeout
+        self.on_done = on_done or (lambda: None)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("", 0))
+        self.sock.settimeout(0.2)
+        self.outstanding = {}
+        self.lock = threading.Condition()
+        self.next_id = 0
+        self.latencies = []
+        self.rcodes = {}
+        self.timeouts = 0
+        self.sent = 0
+        self.running = True
+        threading.Thread(target=self._receive_loop, daemon=True).start()
+        threading.Thread(target=self._reap_loop, daemon=True).start()
+
+    def send(self, domain):
+        with self.lock:
+            while len(self.outstanding) >= 65536:
+                self.lock.wait()
+            while self.next_id in self.outstanding:
+                self.next_id = (self.next_id + 1) & 0xFFFF
+            qid = self.next_id
+            self.next_id = (self.next_id + 1) & 0xFFFF
+            self.outstanding[qid] = time.perf_counter()
+            self.sent += 1
+        query = struct.pack("!H", qid) + dns_wire.build_query(domain)[2:]
+        self.sock.sendto(query, self.server)
+
+    def _finish(self, qid, latency=None, rcode=None):
+        with self.lock:
+            if self.outstanding.pop(qid, None) is None:
+                return
+            if latency is None:
+                self.timeouts += 1
+            else:
+                self.latencies.append(latency)
+                self.rcodes[rcode] = self.rcodes.get(rcode, 0) + 1
+            self.lock.notify_all()
+        self.on_done()
+
+    def _receive_loop(self):
+        while self.running:
+            try:
+                data, _ = self.sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            if len(data) < 12:
+                continue
+            qid, flags = struct.unpack_from("!HH", data)
+            with self.lock:
+                sent_at = self.outstanding.get(qid)
+            if sent_at is not None:
+                self._finish(qid, (time.perf_counter() - sent_at) * 1000, flags & 0xF)
+
+    def _reap_loop(self):
+        while self.running:
+            time.sleep(0.05)
+            cutoff = time.perf_counter() - self.timeout
+            with self.lock:
+                expired = [qid for qid, sent_at in self.outstanding.items() if sent_at < cutoff]
+            for qid in expired:
+                self._finish(qid)
+
+    def drain(self):
+        with self.lock:
+            while self.outstanding:
+                self.lock.wait(0.1)
+        self.running = False
+
+
+def run(queries, args):
+    server = (args.server, args.port)
+    slots = threading.Semaphore(args.concurrency) if args.concurrency else None
+    replayer = Replayer(server, args.timeout, on_done=slots.release if slots else None)
+
+    t_start = time.perf_counter()
+    first_ts = queries[0][0] if queries and queries[0][0] is not None else 0.0
+    for i, (ts, domain) in enumerate(queries):
+        if slots:
+            slots.acquire()
+        elif args.qps:
+            delay = t_start + i / args.qps - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        elif args.timed and ts is not None:
+            delay = t_start + (ts - first_ts) / args.speedup - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        replayer.send(domain)
+    replayer.drain()
+    duration = time.perf_counter() - t_start
+    return replayer, duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay DNS queries against a resolver")
+    parser.add_argument("queries_csv")
+    parser.add_argument("--server", default="10.0.0.5", help="resolver address")
+    parser.add_argument("--port", type=int, default=53)
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--concurrency", type=int, help="closed loop with N outstanding queries")
+    mode.add_argument("--qps", type=float, help="open loop at a fixed query rate")
+    mode.add_argument("--timed", action="store_true", help="replay with the capture timestamps")
+    parser.add_argument("--speedup", type=float, default=1.0, help="time scale for --timed")
+    parser.add_argument("--timeout", type=float, default=5.0, help="seconds before a query counts as lost")
+    parser.add_argument("--limit", type=int, help="only replay the first N queries")
+    parser.add_argument("--host", default=socket.gethostname(), help="label for the summary row")
+    parser.add_argument("--csv", help="append a summary row to this CSV file")
+    args = parser.parse_args()
+    if not (args.concurrency or args.qps or args.timed):
+        args.concurrency = 1
+
+    queries = load_queries(args.queries_csv)[:args.limit]
+    if not queries:
+        print("No queries found.")
+        sys.exit(1)
+
+    mode = (f"closed-loop x{args.concurrency}" if args.concurrency else
+            f"open-loop {args.qps:g} qps" if args.qps else f"timed x{args.speedup:g}")
+    print(f"Replaying {len(queries)} queries to {args.server}:{args.port} ({mode}) ...")
+    replayer, duration = run(queries, args)
+
+    lat = sorted(replayer.latencies)
+    answered = len(lat)
+    p50, p95, p99 = (percentile(lat, p) for p in (50, 95, 99))
+    achieved = answered / duration if duration else 0
+    print(f"\n=== Replay results for {args.host} ===")
+    print(f"Sent: {replayer.sent}  Answered: {answered}  Timeouts: {replayer.timeouts}")
+    print("Response codes: " + ", ".join(f"{RCODES.get(k, k)}={v}" for k, v in sorted(replayer.rcodes.items())))
+    print(f"Duration: {duration:.2f} s  Achieved throughput: {achieved:.2f} answered qps")
+    print(f"Latency p50: {p50:.2f} ms  p95: {p95:.2f} ms  p99: {p99:.2f} ms")
+
+    if args.csv:
+        file_exists = os.path.exists(args.csv)
+        with open(args.csv, "a", newline="") as f:
+            writer = csv.writer(f)
+            if not file_exists:
+                writer.writerow(["Host", "Mode", "Sent", "Answered", "Timeouts", "QPS",
+                                 "p50 (ms)", "p95 (ms)", "p99 (ms)"])
+            writer.writerow([args.host, mode, replayer.sent, answered, replayer.timeouts,
+                             f"{achieved:.2f}", f"{p50:.2f}", f"{p95:.2f}", f"{p99:.2f}"])
+        print(f"\nAppended results to {args.csv}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Tests for the bailiwick checks on cached referrals and glue (run with pytest).
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Custom_Resolver_Scripts"))
+
+from dnslib import DNSRecord, RR, QTYPE, A, NS
+
+import dns_wire
+from resolver_cache import ResolverCache
+
+
+def referral_reply(qname, ns_sets, glue):
+    """
+    A non-authoritative reply to an A query for qname carrying the given
+    NS sets ({owner: [ns names]}) and A glue ({host: ip}). Returns
+    (parsed reply, raw bytes) as store_response takes them.
+    """
+    reply = DNSRecord.question(qname).reply()
+    reply.header.aa = 0
+    for owner, names in ns_sets.items():
+        for ns in names:
+            reply.add_auth(RR(owner, QTYPE.NS, rdata=NS(ns), ttl=3600))
+    for host, ip in glue.items():
+        reply.add_ar(RR(host, QTYPE.A, rdata=A(ip), ttl=3600))
+    data = reply.pack()
+    return dns_wire.parse_response(data), data
+
+
+def store(cache, qname, zone, ns_sets, glue):
+    resp, data = referral_reply(qname, ns_sets, glue)
+    cache.store_response(qname, dns_wire.QTYPE_A, resp, data, zone)
+
+
+def test_out_of_zone_glue_is_dropped():
+    # a .com server refers attacker.com to a .net host and slips in its address
+    cache = ResolverCache()
+    store(cache, "www.attacker.com.", "com.",
+          {"attacker.com.": ["ns1.victim-dns.net."]},
+          {"ns1.victim-dns.net.": "192.0.2.66"})
+    assert cache.get_delegation("attacker.com.") == ["ns1.victim-dns.net."]
+    assert cache.get_glue("ns1.victim-dns.net.") is None
+
+
+def test_upward_referral_is_dropped():
+    # example.com's servers claim to know com.'s nameservers
+    cache = ResolverCache()
+    store(cache, "www.example.com.", "example.com.",
+          {"com.": ["ns.evil.com."]},
+          {"ns.evil.com.": "192.0.2.66"})
+    assert cache.get_delegation("com.") is None
+    assert cache.get_glue("ns.evil.com.") is None
+
+
+def test_in_zone_and_sibling_glue_are_kept():
+    cache = ResolverCache()
+    store(cache, "www.example.net.", "net.",
+          {"example.net.": ["ns1.example.net.", "ns.other.net."]},
+          {"ns1.example.net.": "192.0.2.1", "ns.other.net.": "192.0.2.2"})
+    assert cache.get_glue("ns1.example.net.") == ["192.0.2.1"]
+    assert cache.get_glue("ns.other.net.") == ["192.0.2.2"]
+
+
+def test_root_servers_may_supply_any_glue():
+    cache = ResolverCache()
+    store(cache, "www.example.com.", ".",
+          {"com.": ["a.gtld-servers.net."]},
+          {"a.gtld-servers.net.": "192.0.2.30"})
+    assert cache.get_delegation("com.") == ["a.gtld-servers.net."]
+    assert cache.get_glue("a.gtld-servers.net.") == ["192.0.2.30"]
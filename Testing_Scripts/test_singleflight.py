@@ -0,0 +1,69 @@
+"""
+Tests for SingleFlight query coalescing (run with pytest).
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Custom_Resolver_Scripts"))
+
+from singleflight import SingleFlight
+
+
+def run_concurrently(flights, key, leader_fn, waiters=4):
+    """
+    Start a leader running leader_fn under key, then `waiters` callers of
+    the same key while it is still running. Returns (leader outcome, waiter
+    outcomes), each ("ok", result) or ("error", exception).
+    """
+    started = threading.Event()
+    release = threading.Event()
+    outcomes = {}
+
+    def call(name, fn):
+        try:
+            outcomes[name] = ("ok", flights.do(key, fn))
+        except Exception as e:
+            outcomes[name] = ("error", e)
+
+    def leader():
+        started.set()
+        release.wait(5)
+        return leader_fn()
+
+    threads = [threading.Thread(target=call, args=("leader", leader))]
+    threads[0].start()
+    started.wait(5)
+    for i in range(waiters):
+        threads.append(threading.Thread(target=call, args=(i, lambda: ("waiter ran fn",))))
+        threads[-1].start()
+    while flights.calls[key].waiters < waiters:
+        time.sleep(0.001)
+    release.set()
+    for t in threads:
+        t.join(5)
+    return outcomes.pop("leader"), list(outcomes.values())
+
+
+def test_waiters_share_the_leaders_result():
+    flights = SingleFlight()
+    leader, waiters = run_concurrently(flights, "k", lambda: "answer")
+    assert leader == ("ok", ("answer", False))
+    assert waiters == [("ok", ("answer", True))] * 4
+    assert flights.coalesced == 4
+    assert not flights.calls
+
+
+def test_waiters_get_the_leaders_exception():
+    def fail():
+        raise IndexError("malformed upstream reply")
+
+    flights = SingleFlight()
+    leader, waiters = run_concurrently(flights, "k", fail)
+    assert leader[0] == "error" and isinstance(leader[1], IndexError)
+    assert len(waiters) == 4
+    for kind, error in waiters:
+        assert kind == "error" and isinstance(error, IndexError)
+    # the failed flight is gone; the next caller runs fn() again
+    assert flights.do("k", lambda: "retry") == ("retry", False)